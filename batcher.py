@@ -0,0 +1,132 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# batcher.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+# -----------------------------------------------------------------------------
+# class MicroBatcher
+# -----------------------------------------------------------------------------
+
+class MicroBatcher:
+
+    # -------------------------------------------------------------------------
+    # ctor
+    #
+    # func:     callable taking a list of items and returning a list of results
+    #           of the same length (e.g. ChatClassifier.classify)
+    # window:   time in seconds to collect items before a batch is run
+    # max_size: number of queued items which triggers a batch immediately
+
+    def __init__(self, func, window = 0.01, max_size = 32, executor = None):
+        self.log = logging.getLogger(__name__)
+        self.func = func
+        self.window = window
+        self.max_size = max_size
+        self.executor = executor
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers = 1)
+
+        self.pending = []
+        self.pending_items = 0
+        self.timer = None
+
+        self.in_flight = 0
+        self.num_batches = 0
+        self.num_items = 0
+        self.max_batch_size = 0
+        self.last_batch_size = 0
+
+    # -------------------------------------------------------------------------
+    # submit
+
+    async def submit(self, items):
+        if len(items) == 0:
+            return []
+
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        self.pending.append((items, future))
+        self.pending_items += len(items)
+
+        if self.pending_items >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+
+        return await future
+
+    # -------------------------------------------------------------------------
+    # flush
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if not self.pending:
+            return
+
+        batch = self.pending
+        self.pending = []
+        self.pending_items = 0
+
+        asyncio.ensure_future(self.run_batch(batch))
+
+    # -------------------------------------------------------------------------
+    # run_batch
+
+    async def run_batch(self, batch):
+        items = [item for entry in batch for item in entry[0]]
+
+        self.in_flight += len(items)
+        self.num_batches += 1
+        self.num_items += len(items)
+        self.max_batch_size = max(self.max_batch_size, len(items))
+        self.last_batch_size = len(items)
+
+        try:
+            results = await asyncio.get_event_loop().run_in_executor(self.executor, self.func, items)
+        except Exception as e:
+            self.log.error("Failed to process batch of {} item(s) ({})".format(len(items), e))
+
+            for entry in batch:
+                if not entry[1].done():
+                    entry[1].set_exception(e)
+
+            return
+        finally:
+            self.in_flight -= len(items)
+
+        # hand each caller the slice of results belonging to its items
+
+        offset = 0
+
+        for entry_items, future in batch:
+            if not future.done():
+                future.set_result(list(results[offset:offset + len(entry_items)]))
+
+            offset += len(entry_items)
+
+    # -------------------------------------------------------------------------
+    # get_stats
+
+    def get_stats(self):
+        return { "queue_depth": self.pending_items,
+                 "in_flight": self.in_flight,
+                 "batches": self.num_batches,
+                 "items": self.num_items,
+                 "max_batch_size": self.max_batch_size,
+                 "last_batch_size": self.last_batch_size,
+                 "avg_batch_size": self.num_items / self.num_batches if self.num_batches else 0.0 }
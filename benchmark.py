@@ -0,0 +1,351 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# benchmark.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import time
+import asyncio
+import resource
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+SAMPLE_MESSAGES = [
+    "Wo gibt es Silber?",
+    "Hallo zusammen! Wo finde ich Holz? Brauche dringend welches.",
+    "Auf welcher Insel gibt es Zinn?",
+    "Also in B3 gibt es Silber auf Formentera. Und Kohle gibts da auch.",
+    "wer weiß wos Salz gibt?",
+    "Gibt es in C3 Zinn?",
+    "gn8 leute, bis morgen",
+    "Wir treffen uns am 3. Tag z.B. in A2, ok? Dann fahren wir los...",
+    "lol",
+    "Kann mir jemand sagen wo es Nüsse gibt\nund wo Eisen?",
+]
+
+# -----------------------------------------------------------------------------
+# get_rss (resident memory of this process in bytes)
+# -----------------------------------------------------------------------------
+
+def get_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception as e:
+        # peak instead of current RSS, in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# -----------------------------------------------------------------------------
+# percentile
+# -----------------------------------------------------------------------------
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    pos = min(len(values) - 1, max(0, int(round(p / 100.0 * (len(values) - 1)))))
+
+    return values[pos]
+
+# -----------------------------------------------------------------------------
+# run_segmenter_benchmark (runs in a fresh process per backend)
+# -----------------------------------------------------------------------------
+
+def run_segmenter_benchmark(backend, nlp_module, texts, batch_size):
+    import segmenter
+
+    rss = get_rss()
+    started = time.perf_counter()
+
+    sgmt = segmenter.create_segmenter(backend, nlp_module)
+
+    load_time = time.perf_counter() - started
+
+    # one message at a time (idle bot)
+
+    latencies = []
+    splits = []
+
+    for text in texts:
+        started = time.perf_counter()
+        splits.append(sgmt.split(text))
+        latencies.append(time.perf_counter() - started)
+
+    # batches of queued messages (busy bot)
+
+    started = time.perf_counter()
+
+    for i in range(0, len(texts), batch_size):
+        sgmt.split_many(texts[i:i + batch_size])
+
+    batched_time = time.perf_counter() - started
+
+    return { "backend": backend,
+             "load_s": load_time,
+             "p50_ms": percentile(latencies, 50) * 1000.0,
+             "p95_ms": percentile(latencies, 95) * 1000.0,
+             "msgs_per_s": len(texts) / max(1e-9, sum(latencies)),
+             "batched_msgs_per_s": len(texts) / max(1e-9, batched_time),
+             "memory_mb": (get_rss() - rss) / 1048576.0,
+             "splits": splits }
+
+# -----------------------------------------------------------------------------
+# benchmark_segmenters
+#
+# every backend is measured in its own process, so memory numbers are not
+# distorted by previously loaded backends. "agreement" is the share of
+# messages split exactly like by the first backend.
+# -----------------------------------------------------------------------------
+
+def benchmark_segmenters(backends, nlp_module, texts, batch_size = 32):
+    context = multiprocessing.get_context("spawn")
+    results = []
+    reference = None
+
+    for backend in backends:
+        with ProcessPoolExecutor(max_workers = 1, mp_context = context) as executor:
+            try:
+                res = executor.submit(run_segmenter_benchmark, backend, nlp_module, texts, batch_size).result()
+            except Exception as e:
+                results.append({ "backend": backend, "error": str(e) })
+                continue
+
+        splits = res.pop("splits")
+
+        if reference is None:
+            reference = splits
+
+        res["agreement"] = sum(1 for a, b in zip(splits, reference) if a == b) / max(1, len(texts))
+        results.append(res)
+
+    return results
+
+# -----------------------------------------------------------------------------
+# benchmark_padding
+#
+# CNN latency and accuracy with fixed (maxlen) and length-bucketed padding
+# (see dataset.get_padded_length). predict_proba takes padded token ids,
+# latency includes tokenizing/padding. "max_diff" is the largest probability
+# difference between both modes.
+# -----------------------------------------------------------------------------
+
+def benchmark_padding(predict_proba, dataset, texts, categories, batch_sizes = (1, 32)):
+    import numpy as np
+
+    classes = dataset.get_classes()
+    labels = np.array([classes.index(c) for c in categories])
+    probabilities = {}
+    results = []
+
+    for bucketed in [False, True]:
+        res = { "padding": "bucketed" if bucketed else "fixed" }
+        lengths = []
+
+        for batch_size in batch_sizes:
+            latencies = []
+            pred = []
+
+            for i in range(0, len(texts), batch_size):
+                started = time.perf_counter()
+                x = dataset.prepare_array(texts[i:i + batch_size], bucketed = bucketed, reuse = True)
+                pred.append(np.array(predict_proba(x)))
+                latencies.append((time.perf_counter() - started) / len(x))
+                lengths.append(x.shape[1])
+
+            res["batch_{}_ms".format(batch_size)] = sum(latencies) / max(1, len(latencies)) * 1000.0
+
+        probabilities[bucketed] = np.concatenate(pred)
+        res["accuracy"] = float((probabilities[bucketed].argmax(axis = 1) == labels).mean())
+        res["mean_length"] = sum(lengths) / max(1, len(lengths))
+        results.append(res)
+
+    max_diff = float(np.abs(probabilities[False] - probabilities[True]).max()) if len(texts) else 0.0
+
+    return results, max_diff
+
+# -----------------------------------------------------------------------------
+# replay harness
+#
+# replays a chat corpus through the serving pipeline (keyword gate, sentence
+# split, ChatClassifier.classify, DiscordClient.process_request) against a
+# fixture SheetsCache, with discord replaced by FakeMessage/FakeChannel.
+# -----------------------------------------------------------------------------
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, text):
+        self.sent.append(text)
+
+class FakeMessage:
+    def __init__(self, content, channel):
+        self.content = content
+        self.channel = channel
+        self.author = "replay"
+
+# -----------------------------------------------------------------------------
+# load_fixture_sheets
+#
+# fixture_file: json file with the sheet tabs (see FakeSheetsService). the
+# cache is then built in a temporary directory, so the bot's cache file stays
+# untouched. without fixture_file, the cache file in cache_dir is used.
+# -----------------------------------------------------------------------------
+
+def load_fixture_sheets(cache_dir, fixture_file = None):
+    import tempfile
+    import sheets
+
+    if fixture_file is None:
+        shts = sheets.SheetsCache(cache_dir, None, None, "replay", refresh_time = 3600)
+        shts.get_snapshot()
+        return shts
+
+    from fakesheets import FakeSheetsService
+
+    shts = sheets.SheetsCache(tempfile.mkdtemp(prefix = "larb-replay-"), None, None, "replay", refresh_time = 3600)
+    shts.service = FakeSheetsService.from_file(fixture_file)
+    shts.reload_cache()
+
+    return shts
+
+# -----------------------------------------------------------------------------
+# summarize (latencies in seconds -> percentiles in ms)
+# -----------------------------------------------------------------------------
+
+def summarize(latencies):
+    return { "count": len(latencies),
+             "mean_ms": sum(latencies) / len(latencies) * 1000.0 if latencies else 0.0,
+             "p50_ms": percentile(latencies, 50) * 1000.0,
+             "p95_ms": percentile(latencies, 95) * 1000.0,
+             "p99_ms": percentile(latencies, 99) * 1000.0 }
+
+# -----------------------------------------------------------------------------
+# get_commit (of the working tree, for comparing runs)
+# -----------------------------------------------------------------------------
+
+def get_commit():
+    import subprocess
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)), 
+                                       stderr = subprocess.DEVNULL).decode().strip()
+    except Exception as e:
+        return None
+
+# -----------------------------------------------------------------------------
+# replay
+#
+# phase 1 runs the messages one by one through each stage and records the
+# per-stage latency. phase 2 feeds them through DiscordClient.on_message with
+# `concurrency` messages in flight (micro-batching, caches and gate as when
+# serving) and records end-to-end latency and throughput.
+# -----------------------------------------------------------------------------
+
+async def replay(texts, shts, model_dir = "./model", nlp_module = "de_core_news_sm", segmenter_backend = "spacy", 
+                 runtime = "keras", cascade_margin = None, gate = "on", batch_window = 0.01, batch_size = 32, 
+                 cache_size = 1024, concurrency = 8):
+    import bot
+    import classifier
+    import dataset
+    import segmenter
+    import workers
+
+    res = { "commit": get_commit(), "timestamp": time.time(), "messages": len(texts),
+            "config": { "segmenter": segmenter_backend, "runtime": runtime, "cascade_margin": cascade_margin, "gate": gate,
+                        "batch_window": batch_window, "batch_size": batch_size, "cache_size": cache_size, 
+                        "concurrency": concurrency } }
+
+    # model load
+
+    started = time.perf_counter()
+    sgmt = segmenter.create_segmenter(segmenter_backend, nlp_module)
+    load_segmenter = time.perf_counter() - started
+
+    started = time.perf_counter()
+    clsf = classifier.ChatClassifier(model_save_dir = model_dir, dataset = dataset.InferenceDataset(cache_dir = model_dir), 
+                                     runtime = runtime, cascade_margin = cascade_margin)
+
+    if cascade_margin is not None:
+        clsf.set_prefilter(shts.has_resource_key)
+
+    load_classifier = time.perf_counter() - started
+
+    res["load"] = { "segmenter_s": load_segmenter, "classifier_s": load_classifier }
+
+    # phase 1: per stage latency (no caches)
+
+    lookup_client = bot.DiscordClient(None, shts, cache_size = 0)
+    stages = { "gate": [], "split": [], "classify": [], "lookup": [], "total": [] }
+    num_sentences = 0
+    num_answers = 0
+
+    for text in texts:
+        t0 = time.perf_counter()
+        shts.may_mention_resource(text)
+        t1 = time.perf_counter()
+        sentences = sgmt.split(text)
+        t2 = time.perf_counter()
+        labels = clsf.classify(sentences)
+        t3 = time.perf_counter()
+
+        requests = [(label, sent) for sent, label in zip(sentences, labels) if label != "chat"]
+
+        for label, sent in requests:
+            answer = lookup_client.process_request(label, sent)
+            num_answers += len(answer or [])
+
+        t4 = time.perf_counter()
+
+        stages["gate"].append(t1 - t0)
+        stages["split"].append(t2 - t1)
+        stages["classify"].append(t3 - t2)
+
+        if requests:
+            stages["lookup"].append(t4 - t3)
+
+        stages["total"].append(t4 - t0)
+        num_sentences += len(sentences)
+
+    res["sentences"] = num_sentences
+    res["answers"] = num_answers
+    res["stages"] = { name: summarize(latencies) for name, latencies in stages.items() }
+    res["classifier"] = clsf.get_stats()
+
+    # phase 2: end-to-end through on_message
+
+    pool = workers.WorkerPool(mode = "thread", workers = 2, segmenter = sgmt, classifier = clsf)
+    client = bot.DiscordClient(pool, shts, batch_window = batch_window, batch_size = batch_size, gate = gate, 
+                               cache_size = cache_size)
+    channel = FakeChannel()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def send(text):
+        async with semaphore:
+            started = time.perf_counter()
+            await client.on_message(FakeMessage(text, channel))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[send(text) for text in texts])
+    elapsed = time.perf_counter() - started
+
+    pool.shutdown()
+
+    res["end_to_end"] = summarize(latencies)
+    res["end_to_end"]["msgs_per_s"] = len(texts) / max(1e-9, elapsed)
+    res["end_to_end"]["answers"] = len(channel.sent)
+    res["end_to_end"]["gate"] = client.get_gate_stats()
+    res["end_to_end"]["classification_cache"] = client.classification_cache.get_stats()
+    res["end_to_end"]["answer_cache"] = client.answer_cache.get_stats()
+    res["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    return res
@@ -8,9 +8,22 @@
 # Imports
 # -----------------------------------------------------------------------------
 
+import time
 import logging
 import discord
-import re as rep
+import metrics
+
+from batcher import MicroBatcher
+from cache import LRUCache
+
+MISSING = object()
+
+# -----------------------------------------------------------------------------
+# normalize_sentence (cache key, classifiers ignore case and whitespace)
+# -----------------------------------------------------------------------------
+
+def normalize_sentence(text):
+    return " ".join(text.lower().split())
 
 # -----------------------------------------------------------------------------
 # class DiscordClient
@@ -21,15 +34,86 @@ class DiscordClient(discord.Client):
     #--------------------------------------------------------------------------
     # ctor
 
-    def __init__(self, nlp, classifier, sheets, *args, **kwargs):
+    # gate "on" drops messages without any resource key before spaCy and the
+    # classifier run, "shadow" only counts them (and reports messages which
+    # were answered although the gate would have dropped them), "off" disables
+    # the gate.
+    #
+    # classification results (by normalized sentence) and answers (by matched
+    # resources, grid and sheets snapshot version) are kept in LRU caches of
+    # cache_size entries for cache_ttl seconds. both are cleared whenever the
+    # sheets are reloaded.
+
+    def __init__(self, workers, sheets, batch_window = 0.01, batch_size = 32, gate = "on", cache_size = 1024, 
+                 cache_ttl = 3600, *args, **kwargs):
         discord.Client.__init__(self, *args, **kwargs)
 
         self.log = logging.getLogger(__name__)
-        self.classifier = classifier
+        self.gate = gate
+        self.gate_stats = { "messages": 0, "passed": 0, "dropped": 0, "lost": 0 }
+        self.num_messages = 0
+        self.classification_cache = LRUCache(max_size = cache_size, ttl = cache_ttl)
+        self.answer_cache = LRUCache(max_size = cache_size, ttl = cache_ttl)
+        self.workers = None
+        self.batcher = None
+        self.split_batcher = None
+        self.batch_window = batch_window
+        self.batch_size = batch_size
         self.sheets = sheets
-        self.nlp = nlp
         self.username = None
 
+        self.sheets.add_reload_listener(self.invalidate_caches)
+
+        metrics.cache_entries.set_function(lambda: { ("classification",): len(self.classification_cache), 
+                                                     ("answer",): len(self.answer_cache) })
+        metrics.cache_lookups.set_function(self.get_cache_lookups)
+        metrics.batch_queue.set_function(self.get_queue_depths)
+
+        if workers is not None:
+            self.set_workers(workers)
+
+    #--------------------------------------------------------------------------
+    # invalidate_caches (called by the sheets thread after a reload)
+
+    def invalidate_caches(self, snapshot = None):
+        self.classification_cache.clear()
+        self.answer_cache.clear()
+
+    #--------------------------------------------------------------------------
+    # set_workers (requests are only answered once workers are available)
+
+    def set_workers(self, workers):
+        # concurrent messages are split in one pass (nlp.pipe), their sentences
+        # are collected and classified together
+
+        self.split_batcher = MicroBatcher(workers.split_many_func, window = self.batch_window, 
+                                          max_size = self.batch_size, executor = workers.executor)
+        self.batcher = MicroBatcher(workers.classify_func, window = self.batch_window, 
+                                    max_size = self.batch_size, executor = workers.classify_executor)
+        self.workers = workers
+
+    #--------------------------------------------------------------------------
+    # get_cache_lookups / get_queue_depths (metrics)
+
+    def get_cache_lookups(self):
+        res = {}
+
+        for name, cache in [("classification", self.classification_cache), ("answer", self.answer_cache)]:
+            stats = cache.get_stats()
+            res[(name, "hit")] = stats["hits"]
+            res[(name, "miss")] = stats["misses"]
+
+        return res
+
+    def get_queue_depths(self):
+        res = {}
+
+        for name, batcher in [("split", self.split_batcher), ("classify", self.batcher)]:
+            if batcher is not None:
+                res[(name,)] = batcher.get_stats()["queue_depth"]
+
+        return res
+
     #--------------------------------------------------------------------------
     # on_ready
 
@@ -46,31 +130,133 @@ class DiscordClient(discord.Client):
         if message.author == self.user:
             return
 
-        # use spacy / NLP to split a block of text into separate sentences.
-        # then process sentence by sentence
+        # still warming up
+
+        if self.workers is None:
+            return
+
+        self.num_messages += 1
+
+        if self.num_messages % 1000 == 0:
+            self.log_stats()
+
+        if self.gate == "off":
+            metrics.messages.inc(gate = "off")
+            await self.process_message(message)
+            return
+
+        # keyword gate: messages without any resource key can never be answered
+
+        started = time.perf_counter()
+
+        try:
+            passed = self.sheets.may_mention_resource(message.content)
+        except Exception as e:
+            self.log.error("Failed to check message ({})".format(e))
+            passed = True
+
+        metrics.message_stage.observe(time.perf_counter() - started, stage = "gate")
+        metrics.messages.inc(gate = "passed" if passed else "dropped")
+
+        self.gate_stats["messages"] += 1
+        self.gate_stats["passed" if passed else "dropped"] += 1
+
+        if not passed and self.gate == "on":
+            return
+
+        answers = await self.process_message(message)
+
+        if not passed and answers > 0:
+            self.gate_stats["lost"] += 1
+            self.log.warning("Keyword gate would have dropped answered message [{}]".format(message.content))
+
+    #--------------------------------------------------------------------------
+    # log_stats
+
+    def log_stats(self):
+        if self.gate != "off":
+            self.log.info("Keyword gate ({}): {}".format(self.gate, self.get_gate_stats()))
 
-        doc = self.nlp(message.content)
-        sentences = [sent.string.strip() for sent in doc.sents]
+        self.log.info("Classification cache: {}".format(self.classification_cache.get_stats()))
+        self.log.info("Answer cache: {}".format(self.answer_cache.get_stats()))
 
-        for sent in sentences:
-            # use ML classifier to determine whether or not this sentence is a request for resource location
+    #--------------------------------------------------------------------------
+    # get_gate_stats
+
+    def get_gate_stats(self):
+        res = dict(self.gate_stats)
+        res["pass_rate"] = res["passed"] / res["messages"] if res["messages"] else 1.0
+
+        return res
+
+    #--------------------------------------------------------------------------
+    # process_message (returns the number of answers sent)
+
+    async def process_message(self, message):
+        answers = 0
+        started = time.perf_counter()
+
+        # use the segmenter (spacy / rules) to split a block of text into separate sentences.
+        # then process sentence by sentence. all CPU bound work is done by the
+        # worker pool, only the replies are sent from the event loop.
+
+        try:
+            sentences = (await self.split_batcher.submit([message.content]))[0]
+        except Exception as e:
+            self.log.error("Failed to split chat ({})".format(e))
+            return answers
+
+        metrics.message_stage.observe(time.perf_counter() - started, stage = "split")
+        started = time.perf_counter()
 
+        # use ML classifier to determine whether or not each sentence is a request for resource location.
+        # only sentences not seen recently are classified
+
+        keys = [normalize_sentence(sent) for sent in sentences]
+        results = [self.classification_cache.get(key) for key in keys]
+        pending = [i for i, res in enumerate(results) if res is None]
+
+        if pending:
             try:
-                res = self.classifier.classify([sent])
+                classified = await self.batcher.submit([sentences[i] for i in pending])
+            except Exception as e:
+                self.log.error("Failed to classify chat ({})".format(e))
+                return answers
+
+            for i, res in zip(pending, classified):
+                results[i] = res
+                self.classification_cache.put(keys[i], res)
+
+        metrics.message_stage.observe(time.perf_counter() - started, stage = "classify")
+
+        for res in results:
+            metrics.classifications.inc(label = res)
 
+        for sent, res in zip(sentences, results):
+            try:
                 # if so, process it further
 
-                if res and res[0] != "chat":
-                    response = self.process_request(res[0], sent)
+                if res != "chat":
+                    started = time.perf_counter()
+                    response = await self.workers.lookup(self.process_request, res, sent)
+
+                    metrics.message_stage.observe(time.perf_counter() - started, stage = "lookup")
 
                     if response is None:
-                        return
+                        return answers
 
                     for response_msg in response:
+                        started = time.perf_counter()
                         await message.channel.send(response_msg)
+                        answers += 1
+
+                        metrics.message_stage.observe(time.perf_counter() - started, stage = "send")
+                        metrics.answers.inc()
             except Exception as e:
                 self.log.error("Failed to process chat ({})".format(e))
 
+        return answers
+
     #--------------------------------------------------------------------------
     # process_request
 
@@ -81,73 +267,87 @@ class DiscordClient(discord.Client):
         # currently, only "find_resource" can be a valid query.
 
         if type == "find_resource":
-            msg_lower = message.lower()
-            contains_key = False
+            # single pass over the message, finding all resource keys, islands and grids.
+            # the whole request is answered from one snapshot, even if the sheets are
+            # reloaded meanwhile
 
-            # (1) check if indeed the sentence contains a valid resource key.
+            snapshot = self.sheets.get_snapshot()
+            matches = self.sheets.find_entities_in(snapshot, message)
+            kinds = set(m.kind for m in matches)
 
-            for key in self.sheets.get_keys():
-                if key.lower() in msg_lower:
-                    contains_key = True
-                    break
+            # (1) check if indeed the sentence contains a valid resource key.
 
-            if not contains_key:
+            if "resource_en" not in kinds and "resource_de" not in kinds:
                 return None
 
             # (2) if a valid island name is contained in the sentence ("Wo auf Teneriffa gibts Holz?")
             #     skip the request, as we cannot give locations on islands
 
-            for island in self.sheets.get_islands():
-                if island.lower() in msg_lower:
-                    return None
+            if "island" in kinds:
+                return None
 
             # (3) if a valid grid name is found in the message ("Wo in C2 gibts Holz?")
             #     do a "find_resource_by_grid" query, otherwise plain "find_resource" query
 
-            for grid in self.sheets.get_grids():
-                grid_match = rep.search("[^a-zA-Z0-9]" + grid.lower() + "([^a-zA-Z0-9]|$)", msg_lower)
-                
-                if grid_match is not None:
-                    requested_grid = grid
-                    break
+            grids = self.sheets.matched_keys(matches, "grid")
 
-            if requested_grid is not None:
-                # (4a) give locations for one or more resources in a given grid.
-                #      e.g. "Gibt es in C3 Zinn?"
+            if grids:
+                requested_grid = grids[0]
 
-                self.log.debug("Finding resource by grid via [{}]".format(message))
+            # (4) the answer only depends on the matched resources, the grid and the sheets data
 
-                res = self.sheets.find_resource_by_grid(message, requested_grid)
+            key = (tuple(self.sheets.matched_keys(matches, "resource_en")), tuple(self.sheets.matched_keys(matches, "resource_de")), 
+                   requested_grid, snapshot.version)
 
-                if res is None:
-                    self.log.debug("Resource not found")
-                    return None
+            res = self.answer_cache.get(key, MISSING)
 
-                if "not_yet_in_list" in res:
-                    return [res["title"] + " hat noch niemand in die Resourcenliste eingetragen :/"]
-                
-                if "other_grids" not in res:
-                    return [res["title"] + " gibt es in " + requested_grid + " auf " + ", ".join(res["islands"])]
+            if res is MISSING:
+                res = self.render_answer(snapshot, message, matches, requested_grid)
+                self.answer_cache.put(key, res)
 
-                return [res["title"] + " gibt es in " + requested_grid + " nicht. Aber auf " + ", ".join(res["other_grids"]) + "."]
-            else:
-                # (4b) give locations for one or more resources without grid information.
-                #      e.g. "Wo gibt es Silber?"
+            return res
+        else:
+            self.log.warning("Got request for unknown classification '{}', ignoring!".format(type))
 
-                self.log.debug("Finding resource via [{}]".format(message))
+    #--------------------------------------------------------------------------
+    # render_answer
+
+    def render_answer(self, snapshot, message, matches, requested_grid):
+        if requested_grid is not None:
+            # (4a) give locations for one or more resources in a given grid.
+            #      e.g. "Gibt es in C3 Zinn?"
 
-                res = self.sheets.find_resource(message)
+            self.log.debug("Finding resource by grid via [{}]".format(message))
 
-                if res is None:
-                    self.log.debug("Resource not found")
-                    return None
+            res = self.sheets.find_resource_by_grid_in(snapshot, matches, requested_grid)
 
-                if "not_yet_in_list" in res:
-                    return [res["title"] + " hat noch niemand in die Resourcenliste eingetragen :/"]
+            if res is None:
+                self.log.debug("Resource not found")
+                return None
+
+            if "not_yet_in_list" in res:
+                return [res["title"] + " hat noch niemand in die Resourcenliste eingetragen :/"]
                 
-                return [dict["title"] + " gibt es in " + dict["location"] for dict in res]
+            if "other_grids" not in res:
+                return [res["title"] + " gibt es in " + requested_grid + " auf " + ", ".join(res["islands"])]
+
+            return [res["title"] + " gibt es in " + requested_grid + " nicht. Aber auf " + ", ".join(res["other_grids"]) + "."]
         else:
-            self.log.warning("Got request for unknown classification '{}', ignoring!".format(type))
+            # (4b) give locations for one or more resources without grid information.
+            #      e.g. "Wo gibt es Silber?"
+
+            self.log.debug("Finding resource via [{}]".format(message))
+
+            res = self.sheets.find_resource_in(snapshot, matches)
+
+            if res is None:
+                self.log.debug("Resource not found")
+                return None
+
+            if "not_yet_in_list" in res:
+                return [res["title"] + " hat noch niemand in die Resourcenliste eingetragen :/"]
+                
+            return [dict["title"] + " gibt es in " + dict["location"] for dict in res]
 
 #------------------------------------------------------------------------------
 # class Bot
@@ -158,11 +358,15 @@ class Bot:
     #--------------------------------------------------------------------------
     # ctor
 
-    def __init__(self, token_file_name, nlp, classifier, sheets):
+    def __init__(self, token_file_name, workers, sheets, batch_window = 0.01, batch_size = 32, gate = "on", 
+                 cache_size = 1024, cache_ttl = 3600):
         self.token = ""
         self.client = None
         self.log = logging.getLogger(__name__)
-        self.client = DiscordClient(nlp, classifier, sheets, status = 'idle')
+        self.workers = workers
+        self.client = DiscordClient(workers, sheets, batch_window = batch_window, 
+                                    batch_size = batch_size, gate = gate, cache_size = cache_size, 
+                                    cache_ttl = cache_ttl, status = 'idle')
 
         try:
             with open(token_file_name) as f:
@@ -170,6 +374,13 @@ class Bot:
         except Exception as e:
             self.log.error('Failed to open token file ({})'.format(e))
 
+    #--------------------------------------------------------------------------
+    # set_workers
+
+    def set_workers(self, workers):
+        self.workers = workers
+        self.client.set_workers(workers)
+
     #--------------------------------------------------------------------------
     # connect
 
@@ -185,3 +396,6 @@ class Bot:
 
     async def disconnect(self):
         await self.client.logout()
+
+        if self.workers is not None:
+            self.workers.shutdown()
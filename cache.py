@@ -0,0 +1,100 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# cache.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+# -----------------------------------------------------------------------------
+# class LRUCache
+# -----------------------------------------------------------------------------
+
+class LRUCache:
+
+    # -------------------------------------------------------------------------
+    # ctor
+    #
+    # bounded, thread safe LRU cache. entries older than ttl seconds are treated
+    # as missing. max_size 0 disables the cache (every get is a miss).
+
+    def __init__(self, max_size = 1024, ttl = 3600, clock = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.mutex = Lock()
+        self.entries = OrderedDict()
+        self.stats = { "hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0 }
+
+    # -------------------------------------------------------------------------
+    # get
+
+    def get(self, key, default = None):
+        with self.mutex:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.stats["misses"] += 1
+                return default
+
+            value, expires = entry
+
+            if expires <= self.clock():
+                del self.entries[key]
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return default
+
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+
+            return value
+
+    # -------------------------------------------------------------------------
+    # put
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+
+        with self.mutex:
+            self.entries[key] = (value, self.clock() + self.ttl)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+                self.stats["evictions"] += 1
+
+    # -------------------------------------------------------------------------
+    # clear
+
+    def clear(self):
+        with self.mutex:
+            self.entries.clear()
+            self.stats["invalidations"] += 1
+
+    # -------------------------------------------------------------------------
+    # get_stats
+
+    def get_stats(self):
+        with self.mutex:
+            res = dict(self.stats)
+            res["size"] = len(self.entries)
+
+        lookups = res["hits"] + res["misses"]
+        res["hit_rate"] = res["hits"] / lookups if lookups else 0.0
+
+        return res
+
+    # -------------------------------------------------------------------------
+    # __len__
+
+    def __len__(self):
+        return len(self.entries)
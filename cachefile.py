@@ -0,0 +1,224 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# cachefile.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import mmap
+import struct
+import zlib
+from array import array
+
+from locations import LocationStore
+
+# -----------------------------------------------------------------------------
+# file layout
+# -----------------------------------------------------------------------------
+#
+# header (little endian):
+#   magic (8 bytes), schema version (u16), reserved (u16), crc32 of payload (u32),
+#   payload length (u64)
+#
+# payload, a sequence of little endian u32 arrays:
+#   counts:         strings, records, en resources, de resources, grid names, island names, refs
+#   string table:   strings + 1 offsets into the utf-8 blob, followed by the blob
+#                   (padded to 4 bytes)
+#   names:          grid names, island names (string ids)
+#   records:        grid id, island id, column, row columns, one entry per location,
+#                   followed by the 'TRUE' and 'FALSE' bitmaps (padded to 4 bytes)
+#   en resources:   key, title columns (string ids) + resources + 1 offsets into refs
+#   de resources:   same as en resources
+#   refs:           record ids of all resources
+#
+# all arrays are 4 byte aligned, so a mapped file can be read without copying.
+
+MAGIC = b"LARBSHT\0"
+SCHEMA_VERSION = 2
+
+HEADER = struct.Struct("<8sHHIQ")
+COUNTS = struct.Struct("<7I")
+
+# -----------------------------------------------------------------------------
+# class CacheFileError
+# -----------------------------------------------------------------------------
+
+class CacheFileError(Exception):
+    pass
+
+# -----------------------------------------------------------------------------
+# write_cache_file
+# -----------------------------------------------------------------------------
+
+def write_cache_file(path, resource_map_en, resource_map_de, store):
+    strings = {}
+    refs = array("I")
+
+    def sid(value):
+        if value not in strings:
+            strings[value] = len(strings)
+
+        return strings[value]
+
+    def resource_table(resource_map):
+        keys = array("I")
+        titles = array("I")
+        offsets = array("I", [len(refs)])
+
+        for key, resource in resource_map.items():
+            keys.append(sid(key))
+            titles.append(sid(resource["title"]))
+            refs.extend(resource["records"])
+            offsets.append(len(refs))
+
+        return [keys, titles, offsets]
+
+    grid_names = array("I", [sid(name) for name in store.grid_names])
+    island_names = array("I", [sid(name) for name in store.island_names])
+    table_en = resource_table(resource_map_en)
+    table_de = resource_table(resource_map_de)
+
+    # string table
+
+    blob = bytearray()
+    string_offsets = array("I", [0])
+
+    for value in strings:
+        blob.extend(value.encode("utf-8"))
+        string_offsets.append(len(blob))
+
+    # assemble payload
+
+    parts = [COUNTS.pack(len(strings), len(store), len(resource_map_en), len(resource_map_de), 
+                         len(grid_names), len(island_names), len(refs)),
+             to_bytes(string_offsets), padded(blob), to_bytes(grid_names), to_bytes(island_names)]
+
+    parts.extend(to_bytes(array("I", column)) for column in [store.grids, store.islands, store.cols, store.rows])
+    parts.extend([padded(store.avail), padded(store.unavail)])
+    parts.extend(to_bytes(arr) for arr in table_en + table_de + [refs])
+
+    payload = b"".join(parts)
+    header = HEADER.pack(MAGIC, SCHEMA_VERSION, 0, zlib.crc32(payload) & 0xffffffff, len(payload))
+
+    # write atomically, a crash while writing leaves the previous file intact
+
+    tmp_path = path + ".tmp"
+
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+def to_bytes(arr):
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+
+    return arr.tobytes()
+
+def padded(data):
+    return bytes(data) + b"\0" * (-len(data) % 4)
+
+# -----------------------------------------------------------------------------
+# read_cache_file
+#
+# returns (resource_map_en, resource_map_de, store). raises CacheFileError if 
+# the file is truncated, corrupt or of another schema version.
+# -----------------------------------------------------------------------------
+
+def read_cache_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise CacheFileError("File too short")
+
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+            magic, version, reserved, crc, length = HEADER.unpack_from(mm, 0)
+
+            if magic != MAGIC:
+                raise CacheFileError("Not a cache file")
+
+            if version != SCHEMA_VERSION:
+                raise CacheFileError("Unsupported schema version {} (expected {})".format(version, SCHEMA_VERSION))
+
+            if len(mm) != HEADER.size + length:
+                raise CacheFileError("Truncated file")
+
+            view = memoryview(mm)
+
+            try:
+                payload = view[HEADER.size:]
+
+                if zlib.crc32(payload) & 0xffffffff != crc:
+                    raise CacheFileError("Checksum mismatch")
+
+                return decode_payload(payload)
+            finally:
+                payload = None
+                view.release()
+
+def decode_payload(payload):
+    n_strings, n_records, n_en, n_de, n_grids, n_islands, n_refs = COUNTS.unpack_from(payload, 0)
+    pos = COUNTS.size
+
+    def u32(count):
+        nonlocal pos
+        arr = array("I")
+        arr.frombytes(payload[pos:pos + 4 * count])
+
+        if sys.byteorder != "little":
+            arr.byteswap()
+
+        pos += 4 * count
+        return arr
+
+    def raw(length):
+        nonlocal pos
+        data = bytes(payload[pos:pos + length])
+        pos += length + (-length % 4)
+        return data
+
+    string_offsets = u32(n_strings + 1)
+    blob = raw(string_offsets[-1])
+    strings = [blob[string_offsets[i]:string_offsets[i + 1]].decode("utf-8") for i in range(n_strings)]
+
+    # location records
+
+    store = LocationStore()
+    store.grid_names = [sys.intern(strings[i]) for i in u32(n_grids)]
+    store.island_names = [sys.intern(strings[i]) for i in u32(n_islands)]
+    store.grid_ids = { name: i for i, name in enumerate(store.grid_names) }
+    store.island_ids = { name: i for i, name in enumerate(store.island_names) }
+    store.grids = array("H", u32(n_records))
+    store.islands = u32(n_records)
+    store.cols = array("H", u32(n_records))
+    store.rows = u32(n_records)
+    store.avail = bytearray(raw((n_records + 7) // 8))
+    store.unavail = bytearray(raw((n_records + 7) // 8))
+    store.size = n_records
+
+    # resource maps
+
+    tables = []
+
+    for count in [n_en, n_de]:
+        keys = u32(count)
+        titles = u32(count)
+        offsets = u32(count + 1)
+        tables.append((keys, titles, offsets))
+
+    refs = u32(n_refs)
+    maps = []
+
+    for keys, titles, offsets in tables:
+        maps.append({ strings[keys[i]]: { "title": strings[titles[i]], "records": refs[offsets[i]:offsets[i + 1]] } 
+                      for i in range(len(keys)) })
+
+    return maps[0], maps[1], store
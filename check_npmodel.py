@@ -0,0 +1,225 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# check_npmodel.py
+# -----------------------------------------------------------------------------
+#
+# checks the numpy runtime (npmodel, quantize) against straightforward
+# reference implementations, using random weights. needs numpy only:
+#
+#   python check_npmodel.py
+#
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import tempfile
+import numpy as np
+
+from npmodel import NumpyCNN, pooled_features, fold, dequantize
+from quantize import quantize_model, quantize
+
+VOCAB = 500
+EMBEDDING = 16
+WIDTH = 3
+FILTERS = 24
+DENSE = 20
+CLASSES = 2
+
+# -----------------------------------------------------------------------------
+# reference implementations (one loop per output value, float64)
+# -----------------------------------------------------------------------------
+
+def reference_pooled_features(emb, conv_kernel, conv_bias):
+    n, length, _ = emb.shape
+    width, _, filters = conv_kernel.shape
+    res = np.zeros((n, filters))
+
+    for i in range(n):
+        for f in range(filters):
+            best = None
+
+            for t in range(length - width + 1):
+                value = conv_bias[f]
+
+                for j in range(width):
+                    value += np.dot(emb[i, t + j, :].astype(np.float64), conv_kernel[j, :, f])
+
+                best = value if best is None else max(best, value)
+
+            res[i, f] = max(best, 0.0)
+
+    return res
+
+def reference_batch_norm(weights, prefix, h):
+    return (weights[prefix + "_gamma"] * (h - weights[prefix + "_mean"])
+            / np.sqrt(weights[prefix + "_var"] + weights[prefix + "_epsilon"]) + weights[prefix + "_beta"])
+
+def reference_dequantize(q, scale):
+    res = np.zeros(q.shape)
+    scale = np.broadcast_to(scale, q.shape)
+
+    for index in np.ndindex(q.shape):
+        res[index] = float(q[index]) * float(scale[index])
+
+    return res
+
+def reference_softmax(logits):
+    exp = np.exp(logits - logits.max(axis = 1, keepdims = True))
+
+    return exp / exp.sum(axis = 1, keepdims = True)
+
+# keras layer order of variant 4, batch normalization not folded
+
+def reference_predict_proba(weights, x):
+    emb = weights["embedding"][x]
+    hidden = reference_pooled_features(emb, weights["conv_kernel"], weights["conv_bias"])
+    hidden = reference_batch_norm(weights, "bn1", hidden)
+    hidden = np.maximum(hidden @ weights["dense_kernel"] + weights["dense_bias"], 0.0)
+    hidden = reference_batch_norm(weights, "bn2", hidden)
+
+    return reference_softmax(hidden @ weights["out_kernel"] + weights["out_bias"])
+
+# -----------------------------------------------------------------------------
+# random_weights (same layout as export_keras_model)
+# -----------------------------------------------------------------------------
+
+def random_weights(r):
+    weights = { "embedding": r.randn(VOCAB, EMBEDDING) * 0.5,
+                "conv_kernel": r.randn(WIDTH, EMBEDDING, FILTERS) * 0.3,
+                "conv_bias": r.randn(FILTERS) * 0.1,
+                "dense_kernel": r.randn(FILTERS, DENSE) * 0.3,
+                "dense_bias": r.randn(DENSE) * 0.1,
+                "out_kernel": r.randn(DENSE, CLASSES) * 0.3,
+                "out_bias": r.randn(CLASSES) * 0.1 }
+
+    for prefix, size in [("bn1", FILTERS), ("bn2", DENSE)]:
+        weights[prefix + "_gamma"] = 1.0 + 0.2 * r.randn(size)
+        weights[prefix + "_beta"] = 0.2 * r.randn(size)
+        weights[prefix + "_mean"] = 0.2 * r.randn(size)
+        weights[prefix + "_var"] = 0.5 + r.rand(size)
+        weights[prefix + "_epsilon"] = np.array(1e-3)
+
+    return { name: np.asarray(value, dtype = np.float32) for name, value in weights.items() }
+
+def random_tokens(r, n, length):
+    x = r.randint(1, VOCAB, size = (n, length))
+
+    # pre-padded like dataset.prepare_array
+
+    for row, used in enumerate(r.randint(1, length + 1, size = n)):
+        x[row, :length - used] = 0
+
+    return x
+
+# -----------------------------------------------------------------------------
+# checks
+# -----------------------------------------------------------------------------
+
+def check_pooled_features(r):
+    for length in [WIDTH, 8, 16, 33]:
+        emb = r.randn(5, length, EMBEDDING).astype(np.float32)
+        conv_kernel = r.randn(WIDTH, EMBEDDING, FILTERS).astype(np.float32)
+        conv_bias = r.randn(FILTERS).astype(np.float32)
+
+        expected = reference_pooled_features(emb, conv_kernel, conv_bias)
+        actual = pooled_features(emb, conv_kernel, conv_bias)
+
+        np.testing.assert_allclose(actual, expected, rtol = 1e-4, atol = 1e-4)
+
+def check_fold(r):
+    weights = random_weights(r)
+    h = r.randn(10, FILTERS)
+
+    kernel, bias = fold(weights, "bn1", weights["dense_kernel"], weights["dense_bias"])
+    expected = reference_batch_norm(weights, "bn1", h) @ weights["dense_kernel"] + weights["dense_bias"]
+
+    np.testing.assert_allclose(h @ kernel + bias, expected, rtol = 1e-4, atol = 1e-4)
+
+def check_float_model(r, directory):
+    weights = random_weights(r)
+    model_path = os.path.join(directory, "float.npz")
+
+    np.savez(model_path, **weights)
+
+    x = random_tokens(r, 20, 16)
+
+    np.testing.assert_allclose(NumpyCNN(model_path).predict_proba(x), reference_predict_proba(weights, x),
+                               rtol = 1e-4, atol = 1e-5)
+
+def check_quantize(r):
+    for shape, axis in [((VOCAB, EMBEDDING), 1), ((WIDTH, EMBEDDING, FILTERS), (0, 1)), ((FILTERS, DENSE), 0)]:
+        w = r.randn(*shape).astype(np.float32)
+        w[0] = 0.0
+
+        q, scale = quantize(w, axis)
+
+        assert q.dtype == np.int8 and q.min() >= -127
+        np.testing.assert_allclose(dequantize(q, scale), reference_dequantize(q, scale), rtol = 1e-6)
+
+        # symmetric rounding: at most half a step per value
+
+        assert (np.abs(reference_dequantize(q, scale) - w) <= np.broadcast_to(scale, w.shape) * 0.5 + 1e-6).all()
+
+def check_int8_model(r, directory):
+    float_path = os.path.join(directory, "float.npz")
+    int8_path = os.path.join(directory, "int8.npz")
+
+    np.savez(float_path, **random_weights(r))
+
+    x = random_tokens(r, 20, 16)
+    quantize_model(float_path, int8_path, VOCAB, x)
+
+    # int8 model with the weights dequantized by the reference loop, batch
+    # normalization is already folded by quantize_model
+
+    with np.load(int8_path) as q:
+        weights = { "embedding": reference_dequantize(q["embedding_q"], q["embedding_scale"]),
+                    "conv_kernel": reference_dequantize(q["conv_kernel_q"], q["conv_kernel_scale"]),
+                    "conv_bias": q["conv_bias"],
+                    "dense_kernel": reference_dequantize(q["dense_kernel_q"], q["dense_kernel_scale"]),
+                    "dense_bias": q["dense_bias"],
+                    "out_kernel": q["out_kernel"],
+                    "out_bias": q["out_bias"] }
+
+    model = NumpyCNN(int8_path)
+
+    np.testing.assert_allclose(model.lookup(x), weights["embedding"][x], rtol = 1e-6)
+
+    hidden = reference_pooled_features(weights["embedding"][x], weights["conv_kernel"], weights["conv_bias"])
+    hidden = np.maximum(hidden @ weights["dense_kernel"] + weights["dense_bias"], 0.0)
+    expected = reference_softmax(hidden @ weights["out_kernel"] + weights["out_bias"])
+
+    np.testing.assert_allclose(model.predict_proba(x), expected, rtol = 1e-4, atol = 1e-5)
+
+# -----------------------------------------------------------------------------
+# main
+# -----------------------------------------------------------------------------
+
+def main(seed = 0):
+    r = np.random.RandomState(seed)
+    failed = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        checks = [("pooled_features", lambda: check_pooled_features(r)),
+                  ("fold", lambda: check_fold(r)),
+                  ("float model", lambda: check_float_model(r, directory)),
+                  ("quantize", lambda: check_quantize(r)),
+                  ("int8 model", lambda: check_int8_model(r, directory))]
+
+        for name, func in checks:
+            try:
+                func()
+                print("{:<16} ok".format(name))
+            except AssertionError as e:
+                print("{:<16} FAILED\n{}".format(name, e))
+                failed += 1
+
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
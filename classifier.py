@@ -8,18 +8,12 @@
 # Imports
 # -----------------------------------------------------------------------------
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import SGDClassifier
-from sklearn.linear_model import LogisticRegression
-from sklearn.pipeline import Pipeline
-from sklearn.model_selection import KFold
-from sklearn.metrics import accuracy_score
-
 import os
+import logging
+import threading
 import numpy as np
 import pickle
-
-from rnn import RNN
+import metrics
 
 # -----------------------------------------------------------------------------
 # class ChatClassifier
@@ -30,19 +24,50 @@ class ChatClassifier:
     # -------------------------------------------------------------------------
     # class ChatClassifier
 
-    def __init__(self, model_save_dir, model_type = "RNN", variant = 4, dataset = None, do_train = False):
+    # runtime "keras" serves the CNN with keras/tensorflow, runtime "numpy" serves
+    # the exported weights (see export_model) with a numpy-only forward pass,
+    # runtime "int8" the quantized/pruned weights (see quantize_model).
+    #
+    # cascade_margin enables the classification cascade (see classify). None
+    # runs CNN and SGD for every sentence.
+
+    def __init__(self, model_save_dir, model_type = "RNN", variant = 4, dataset = None, do_train = False, runtime = "keras", 
+                 cascade_margin = None):
+        self.log = logging.getLogger(__name__)
         self.variant = variant
         self.model_type = model_type
         self.dataset = dataset
+        self.runtime = runtime
         self.model = None
+        self.cascade_margin = cascade_margin
+        self.prefilter = None
+        self.stats_mutex = threading.Lock()
+        self.stats = { "sentences": 0, "keyword": 0, "sgd": 0, "cnn": 0 }
 
         self.model_save_path_dnn = model_save_dir + "/rnn_" + dataset.get_model_filename()
+        self.model_save_path_npz = os.path.splitext(self.model_save_path_dnn)[0] + ".npz"
+        self.model_save_path_int8 = os.path.splitext(self.model_save_path_dnn)[0] + ".int8.npz"
         self.model_save_path_sgd = model_save_dir + "/chat_classifier.pkl"
 
         if not os.path.exists(model_save_dir):
             os.makedirs(model_save_dir)
-        
-        if not os.path.exists(self.model_save_path_dnn) or do_train:
+
+        model_paths = { "numpy": self.model_save_path_npz, "int8": self.model_save_path_int8 }
+        model_path = model_paths.get(runtime, self.model_save_path_dnn)
+
+        # the numpy/int8 models are created from a trained keras model, they
+        # cannot be trained here (and serving has no training data anyway)
+
+        if not do_train and runtime in model_paths and not os.path.exists(model_path):
+            message = "Model '{}' for runtime '{}' not found, create it with '{}'".format(
+                model_path, runtime, "larb --export" if runtime == "numpy" else "larb --quantize")
+
+            # logged here as well, in process mode this runs in a worker initializer
+
+            self.log.error(message)
+            raise FileNotFoundError(message)
+
+        if not os.path.exists(model_path) or do_train:
             self.train_model()
         else:
             self.load_model()
@@ -53,6 +78,9 @@ class ChatClassifier:
     def save_model(self):
         self.model1.save_weights()
 
+        if self.variant == 4:
+            self.export_model()
+
         try:
             with open(self.model_save_path_sgd, 'wb') as fid:
                 pickle.dump(self.model2, fid)
@@ -63,40 +91,220 @@ class ChatClassifier:
     # load_model
 
     def load_model(self):
-        self.model1 = RNN(0.0008, self.dataset, self.model_save_path_dnn, variant = self.variant)
-        self.model1.load_weights()
+        if self.runtime == "numpy" or self.runtime == "int8":
+            from npmodel import NumpyCNN
+
+            self.model1 = NumpyCNN(self.model_save_path_npz if self.runtime == "numpy" else self.model_save_path_int8)
+        else:
+            from rnn import RNN
+
+            self.model1 = RNN(0.0008, self.dataset, self.model_save_path_dnn, variant = self.variant)
+            self.model1.load_weights()
 
         try:
             with open(self.model_save_path_sgd, 'rb') as fid:
                 self.model2 = pickle.load(fid)
         except Exception as e:
-            self.log.error("Failed to open model '{}' ({})".format(self.mode_save_path, e))
+            self.log.error("Failed to open model '{}' ({})".format(self.model_save_path_sgd, e))
 
     # -------------------------------------------------------------------------
     # train_model
 
     def train_model(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import SGDClassifier
+        from sklearn.pipeline import Pipeline
+        from rnn import RNN
+
         self.model1 = RNN(0.0008, self.dataset, self.model_save_path_dnn, variant = self.variant)
         self.model1.train(5, 32, self.dataset)
             
-        self.model2 = Pipeline([('tfidf', TfidfVectorizer()), ('sgd', SGDClassifier())])
-        self.model2.fit(self.dataset.x, self.dataset.y)
+        if self.dataset.streaming:
+            self.model2 = self.train_sgd_streaming()
+        else:
+            self.model2 = Pipeline([('tfidf', TfidfVectorizer()), ('sgd', SGDClassifier())])
+            self.model2.fit(*self.dataset.get_texts(self.dataset.rows_train))
+
         self.save_model()
 
+    # -------------------------------------------------------------------------
+    # train_sgd_streaming
+    #
+    # same pipeline as train_model, but the tfidf vocabulary is fitted on a
+    # random sample of max_vocab_rows training sentences, and the SGD classifier
+    # is trained chunk by chunk (partial_fit, one pass per epoch). the rows are
+    # shuffled across the whole corpus every epoch, the csv file itself is
+    # ordered by source/class.
+
+    def train_sgd_streaming(self, epochs = 5, max_vocab_rows = 200000, chunk_size = 10000):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import SGDClassifier
+        from sklearn.pipeline import Pipeline
+
+        sample = next(self.dataset.generate_row_batches("train", max_vocab_rows, shuffle = True), [])
+
+        vectorizer = TfidfVectorizer()
+        vectorizer.fit(self.dataset.get_texts(sample)[0])
+
+        sgd = SGDClassifier()
+
+        for epoch in range(epochs):
+            for rows in self.dataset.generate_row_batches("train", chunk_size, shuffle = True):
+                texts, categories = self.dataset.get_texts(rows)
+                sgd.partial_fit(vectorizer.transform(texts), categories, classes = self.dataset.get_classes())
+
+        return Pipeline([('tfidf', vectorizer), ('sgd', sgd)])
+
+    # -------------------------------------------------------------------------
+    # export_model (freeze the keras CNN for the numpy runtime)
+
+    def export_model(self):
+        from npmodel import export_keras_model
+
+        export_keras_model(self.model1.model, self.model_save_path_npz)
+
+        return self.model_save_path_npz
+
+    # -------------------------------------------------------------------------
+    # quantize_model (int8/pruned copy of the exported CNN, needs a Dataset
+    # with train/test split). returns the comparison of float and int8 model.
+    # a StreamingDataset contributes max_rows train/test sentences.
+
+    def quantize_model(self, prune_filters = 0.0, max_rows = 50000):
+        from quantize import quantize_model, compare_models
+
+        if self.runtime == "keras" or not os.path.exists(self.model_save_path_npz):
+            self.export_model()
+
+        if self.dataset.streaming:
+            x_calib, y_calib = self.dataset.get_sample("train", max_rows)
+            x_test, y_test = self.dataset.get_sample("test", max_rows)
+        else:
+            x_calib, x_test, y_test = self.dataset.x_train, self.dataset.x_test, self.dataset.y_test
+
+        quantize_model(self.model_save_path_npz, self.model_save_path_int8, self.dataset.get_num_tokens(), 
+                       x_calib, prune_filters = prune_filters)
+
+        res = compare_models(self.model_save_path_npz, self.model_save_path_int8, x_test, y_test)
+        res["sentences"] = len(x_test)
+
+        return res
+
+    # -------------------------------------------------------------------------
+    # set_prefilter
+    #
+    # optional first cascade stage: func(sentence) returns False for sentences
+    # which can never be answered (e.g. no resource key), they are "chat".
+
+    def set_prefilter(self, func):
+        self.prefilter = func
+
     # -------------------------------------------------------------------------
     # classify
+    #
+    # without cascade, every sentence runs through CNN and SGD. with cascade:
+    #
+    # stage 0: sentences rejected by the prefilter are "chat"
+    # stage 1: SGD margin. sentences outside of [-cascade_margin, cascade_margin]
+    #          get the SGD label
+    # stage 2: the remaining (uncertain) sentences run through CNN and SGD
 
     def classify(self, sentences):
-        res = []
+        if len(sentences) == 0:
+            return []
+
+        if self.cascade_margin is None:
+            return self.classify_full(sentences)
+
+        labels = np.array(["chat"] * len(sentences), dtype = object)
+        pending = np.arange(len(sentences))
+
+        if self.prefilter is not None:
+            pending = pending[np.array([bool(self.prefilter(s)) for s in sentences], dtype = bool)]
+
+        num_sgd = len(pending)
+        num_cnn = 0
 
-        for sent in sentences:
-            res1= self.model1.predict([sent], self.dataset)[0]
-            res2= self.model2.predict([sent])[0]
+        if num_sgd > 0:
+            margin = self.model2.decision_function([sentences[i] for i in pending])
+            labels[pending] = self.sgd_labels(margin)
 
-            if res1[0] != res and res1[1] < 0.85:
-                res.append(res2)
-            else:
-                res.append(res1[0])
+            escalate = pending[np.abs(margin) < self.cascade_margin]
+            num_cnn = len(escalate)
+
+            if num_cnn > 0:
+                labels[escalate] = self.classify_full([sentences[i] for i in escalate])
+
+        with self.stats_mutex:
+            self.stats["sentences"] += len(sentences)
+            self.stats["keyword"] += len(sentences) - num_sgd
+            self.stats["sgd"] += num_sgd - num_cnn
+            self.stats["cnn"] += num_cnn
+
+        metrics.classifier_stage.inc(len(sentences) - num_sgd, stage = "keyword")
+        metrics.classifier_stage.inc(num_sgd - num_cnn, stage = "sgd")
+        metrics.classifier_stage.inc(num_cnn, stage = "cnn")
+
+        return list(labels)
+
+    # -------------------------------------------------------------------------
+    # sgd_labels (binary decision_function: positive margin is classes_[1])
+
+    def sgd_labels(self, margin):
+        classes = self.model2.classes_
+
+        return np.where(np.asarray(margin) > 0, classes[1], classes[0]).astype(object)
+
+    # -------------------------------------------------------------------------
+    # get_stats (share of sentences decided by each cascade stage)
+
+    def get_stats(self):
+        with self.stats_mutex:
+            res = dict(self.stats)
+
+        for stage in ["keyword", "sgd", "cnn"]:
+            res[stage + "_rate"] = res[stage] / res["sentences"] if res["sentences"] else 0.0
 
         return res
 
+    # -------------------------------------------------------------------------
+    # evaluate_cascade
+    #
+    # accuracy of the full ensemble and of the cascade for each margin, plus
+    # the share of sentences escalated to the CNN (no prefilter).
+
+    def evaluate_cascade(self, texts, categories, margins):
+        categories = np.asarray(categories, dtype = object)
+        full = np.array(self.classify_full(list(texts)), dtype = object)
+        margin = self.model2.decision_function(list(texts))
+        sgd = self.sgd_labels(margin)
+        res = []
+
+        for m in margins:
+            escalate = np.abs(margin) < m
+            labels = np.where(escalate, full, sgd)
+
+            res.append({ "margin": m, "accuracy": float((labels == categories).mean()), 
+                         "escalation_rate": float(escalate.mean()) })
+
+        return float((full == categories).mean()), res
+
+    # -------------------------------------------------------------------------
+    # classify_full
+
+    def classify_full(self, sentences):
+        # one CNN forward pass and one SGD pass over the whole batch
+
+        res1 = self.model1.predict(sentences, self.dataset)
+        res2 = self.model2.predict(sentences)
+
+        labels = np.array([r[0] for r in res1], dtype = object)
+        confidence = np.array([r[1] for r in res1])
+
+        # fall back to the SGD result wherever the CNN is not confident enough
+
+        fallback = confidence < 0.85
+
+        metrics.classifier_fallback.inc(int(fallback.sum()))
+
+        return list(np.where(fallback, res2, labels))
@@ -9,105 +9,260 @@
 # -----------------------------------------------------------------------------
 
 import numpy as np
-import pandas as pd
 import pickle
 import os
-import matplotlib.pyplot as plt
-import random
+import csv
+import shutil
+import hashlib
+import json
+import threading
+import collections
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from sheets import SheetsCache
+from matcher import KeywordMatcher
 
-from sklearn.utils import shuffle
-from sklearn.model_selection import train_test_split
+# training-only dependencies (pandas, sklearn, matplotlib, keras utils) are
+# imported where they are used, so serving does not pay for them at startup.
 
-from keras.utils.np_utils import to_categorical
-from keras.preprocessing.text import Tokenizer
-from keras.preprocessing.sequence import pad_sequences
+# -----------------------------------------------------------------------------
+# class DataGenerator
+#
+# turns a line of a training source into a dataset row: the lowercased line
+# (without its last character, i.e. the newline) with every grid key and then
+# every resource key replaced by " " (in list order, one after another),
+# plus the number of keys still found afterwards.
+#
+# instead of one str.replace/"in" per key and line, a single automaton pass
+# finds the keys contained in the line, and only those are replaced/counted.
+# this gives the same result: replacing a key by " " can only create new
+# occurrences of keys that contain a space, so keys with spaces (and an empty
+# key) are always checked.
+# -----------------------------------------------------------------------------
 
-from sheets import SheetsCache
+class DataGenerator:
+
+    # -------------------------------------------------------------------------
+    # ctor
+
+    def __init__(self, grid_keys, resource_keys, keys):
+        replacements = [key.lower() for key in grid_keys] + [key.lower() for key in resource_keys]
+        counted = [key.lower() for key in keys]
+        patterns = set(replacements) | set(counted)
+
+        # position(s) of every pattern in the replacement order, multiplicity when counting
+
+        self.steps = collections.defaultdict(list)
+        self.counts = collections.Counter(counted)
+
+        for step, key in enumerate(replacements):
+            self.steps[key].append(step)
+
+        self.always = set(key for key in patterns if key == "" or " " in key)
+        self.always_steps = sorted((step, key) for key in self.always for step in self.steps.get(key, []))
+        self.matcher = KeywordMatcher((key, key) for key in patterns)
+
+    # -------------------------------------------------------------------------
+    # process_line (returns (text, n_resource_keys, n_words, length) or None)
+
+    def process_line(self, line):
+        text = line[:-1].lower()
+        found = set(key for start, end, key in self.matcher.find_all(text))
+
+        steps = [(step, key) for key in found - self.always for step in self.steps.get(key, [])]
+        steps.extend(self.always_steps)
+        steps.sort()
+
+        for step, key in steps:
+            text = text.replace(key, " ")
+
+        n_keys = sum(self.counts[key] for key in found | self.always if key in self.counts and key in text)
+
+        if len(text) <= 0:
+            return None
+
+        return (text, n_keys, len(text.split()), len(text))
+
+# per-process generator of the generate_data pool
+
+generator = None
+
+def init_generator(grid_keys, resource_keys, keys):
+    global generator
+    generator = DataGenerator(grid_keys, resource_keys, keys)
+
+def generate_rows(chunk):
+    tag, lines = chunk
+    res = []
+
+    for line in lines:
+        row = generator.process_line(line)
+
+        if row is not None:
+            res.append((row[0], tag) + row[1:])
+
+    return res
+
+# read_chunks (lists of lines per source file, tagged with the category)
+
+def read_chunks(data_dir, sources, chunk_size):
+    for filename, tag in sources:
+        with open(data_dir + '/' + filename) as f:
+            lines = []
+
+            for line in f:
+                lines.append(line)
+
+                if len(lines) >= chunk_size:
+                    yield (tag, lines)
+                    lines = []
+
+            if lines:
+                yield (tag, lines)
+
+# generate_chunks (rows per chunk, in input order, at most max_pending chunks in flight)
+
+def generate_chunks(executor, chunks, max_pending):
+    if executor is None:
+        for chunk in chunks:
+            yield generate_rows(chunk)
 
-import tensorflow as tf
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
-tf.logging.set_verbosity(tf.logging.ERROR)
+        return
+
+    pending = collections.deque()
+
+    for chunk in chunks:
+        pending.append(executor.submit(generate_rows, chunk))
+
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
 
 # -----------------------------------------------------------------------------
-# class Dataset
+# load_tokenizer
+#
+# loads the keras tokenizer of cache_dir, or creates, fits and stores a new
+# one. get_texts returns an iterable of text lists to fit on (e.g. chunks of
+# the csv file), it is only called when a new tokenizer is needed.
 # -----------------------------------------------------------------------------
 
-class Dataset:
+def load_tokenizer(cache_dir, num_words, get_texts):
+    tokenizer_file = cache_dir + '/chat_classification.tokenizer'
 
-    # -------------------------------------------------------------------------
-    # generate_data
+    if os.path.isfile(tokenizer_file):
+        with open(tokenizer_file, "rb") as f:
+            return pickle.load(f)
 
-    def generate_data(sheets:SheetsCache, data_dir, sources, resource_keys, grid_keys):
-        i = 0
-        dict = {}
-        keys = sheets.get_keys()
-        skipped_keys = ["kraken","anglerfish","animals","armflosser","birds","catfish","delfin","drache","drake","dolphin","fisch","fish","hai","gemeiner wal","monströser wal","sanfter wal",
-                        "essbare pflanzen", "feuerelementar", "fire elemental", "giant ant", "giant bee", "giant crab", "gorgon", "gorgonen",
-                        "hase", "affe", "giraffe", "elefant", "elephant", "rhino", "nashorn", "hydra", "kabeljau", "klapperschlange", "kobra", "cobra", "krähe", "crow", "kuh", "leatherwing", "lederschwinge",
-                        "lion", "löwe", "manta ray", "mantarochen", "meerjungfrau", "monkey", "monsters", "nashorn", "ostrich", "papagei", "parrot", "pferd" "pig", "qualle", "rabbit", "razortooth",
-                        "reptiles", "reptilien", "rhino", "riesenameise", "riesenbiene", "riesenkrabbe", "rock elemental", "schaf", "schildkröte", "schildhorn", "shieldhorn", "scorpion", "skorpion", 
-                        "seagull", "seemöwe", "shark", "sheep", "speerfisch", "spinne", "squid", "tintenfisch", "steinelementar", "säbelzahn", "säugetiere", "thunfisch", "tuna", "tiere", "tiger", 
-                        "turtle", "ungeheuer", "vulture", "vögel", "wirbellose", "wolf", "wolfsbarsch", "yeti", "zyklop", "invertebrates"]
+    from keras.preprocessing.text import Tokenizer
 
-        for filename, tag in sources:
-            with open(data_dir + '/' + filename) as my_file:
+    tokenizer = Tokenizer(num_words = num_words, filters = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n', lower = True)
 
-                for line in my_file:
-                    # if "#resource#" in line and "#grid#" in line:
-                    #     replacement_grids = random.choices(grid_keys, k = 3) # int(len(grid_keys) / 2))
-                    #     replacement_keys = [i for i in resource_keys if i not in skipped_keys]
+    for texts in get_texts():
+        tokenizer.fit_on_texts(texts)
 
-                    #     for val in replacement_grids:
-                    #         random_resource = random.choice(replacement_keys)
+    with open(tokenizer_file, 'wb') as f:
+        pickle.dump(tokenizer, f, pickle.HIGHEST_PROTOCOL)
 
-                    #         text = line[:-1].replace("#grid#", val).replace("#resource#", random_resource).lower()
+    InferenceDataset.write_vocabulary(tokenizer, cache_dir + '/' + InferenceDataset.vocabulary_name)
 
-                    #         n_keys = 0
+    return tokenizer
 
-                    #         for k in keys:
-                    #             if k.lower() in text:
-                    #                 n_keys += 1
+# -----------------------------------------------------------------------------
+# get_padded_length (length-bucketed padding for inference)
+#
+# instead of padding every batch to maxlen, batches are padded to the
+# smallest bucket which leaves at least MIN_PADDING leading zeros before the
+# longest sequence. for the Conv1D model (variant 4, kernel width 3) this is
+# exact: with 3 or more padding positions, the convolution sees the same set
+# of windows as with maxlen, and global max pooling ignores how often a
+# window occurs.
+# -----------------------------------------------------------------------------
 
-                    #         if len(text) > 0:
-                    #             dict[i] = { 'text': text, 'category': tag, 'n_resource_keys': n_keys, 'n_words': len(text.split()), 'length': len(text) }
-                    #             i += 1
+BUCKETS = (8, 16, 32, 64)
+MIN_PADDING = 3
 
-                    # elif "#resource#" in line:
-                    #     replacement_keys = [i for i in resource_keys if i not in skipped_keys]
-                    #     replacement_keys = random.choices(replacement_keys, k = 3) # int(len(replacement_keys) / 2))
+def get_padded_length(sequences, maxlen):
+    needed = max((len(seq) for seq in sequences), default = 0) + MIN_PADDING
 
-                    #     for val in replacement_keys:
-                    #         text = line[:-1].replace("#resource#", val).lower()
+    for bucket in BUCKETS:
+        if needed <= bucket and bucket < maxlen:
+            return bucket
 
-                    #         n_keys = 0
+    return maxlen
 
-                    #         for k in keys:
-                    #             if k.lower() in text:
-                    #                 n_keys += 1
+# -----------------------------------------------------------------------------
+# file_hash (sha1 of a file's content, read in blocks)
+# -----------------------------------------------------------------------------
 
-                    #         if len(text) > 0:
-                    #             dict[i] = { 'text': text, 'category': tag, 'n_resource_keys': n_keys, 'n_words': len(text.split()), 'length': len(text) }
-                    #             i += 1
-                    # else:
-                    text = line[:-1].lower()
-                    n_keys = 0
+def file_hash(file_name):
+    digest = hashlib.sha1()
 
-                    for grid_key in grid_keys:
-                        text = text.replace(grid_key.lower(), " ")
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
 
-                    for resource_key in resource_keys:
-                        text = text.replace(resource_key.lower(), " ")
+    return digest.hexdigest()
 
-                    for k in keys:
-                        if k.lower() in text:
-                            n_keys += 1
+# -----------------------------------------------------------------------------
+# class Dataset
+# -----------------------------------------------------------------------------
 
-                    if len(text) > 0:
-                        dict[i] = { 'text': text, 'category': tag, 'n_resource_keys': n_keys, 'n_words': len(text.split()), 'length': len(text) }
+class Dataset:
+    streaming = False
+
+    # -------------------------------------------------------------------------
+    # generate_data
+    #
+    # streams all source files in chunks of lines through a process pool and
+    # writes chat_dataset.csv incrementally (same content and format as the
+    # former pandas DataFrame.to_csv). see DataGenerator.
+
+    def generate_data(sheets:SheetsCache, data_dir, sources, resource_keys, grid_keys, workers = None, chunk_size = 2000):
+        keys = sheets.get_keys()
+        file_name = data_dir + "/chat_dataset.csv"
+        tmp_file_name = file_name + ".tmp"
+        executor = None
+        i = 0
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers = workers, 
+                                           mp_context = multiprocessing.get_context("spawn"),
+                                           initializer = init_generator,
+                                           initargs = (grid_keys, resource_keys, keys))
+        else:
+            init_generator(grid_keys, resource_keys, keys)
+
+        try:
+            with open(tmp_file_name, "w", newline = "") as f:
+                writer = csv.writer(f, lineterminator = "\n")
+                writer.writerow(["", "text", "category", "n_resource_keys", "n_words", "length"])
+
+                for rows in generate_chunks(executor, read_chunks(data_dir, sources, chunk_size), 2 * workers):
+                    for row in rows:
+                        writer.writerow([i] + list(row))
                         i += 1
 
-        df = pd.DataFrame.from_dict(dict, "index")
-        df.to_csv(data_dir + "/chat_dataset.csv")
+            # pandas writes an empty frame as ""
+
+            if i == 0:
+                with open(tmp_file_name, "w") as f:
+                    f.write('""\n')
+
+            os.replace(tmp_file_name, file_name)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+            if os.path.exists(tmp_file_name):
+                os.remove(tmp_file_name)
+
+        return i
 
     # -------------------------------------------------------------------------
     # ctor
@@ -123,56 +278,101 @@ class Dataset:
         self.df = None
 
         if csv_file is not None:
+            import pandas as pd
+
             try:
-                self.df = shuffle(pd.read_csv(csv_file, dtype = { "text": str, "category": str, "n_resource_keys": np.int8, "n_words": np.int8, "length": np.int8 }))
+                self.df = pd.read_csv(csv_file, dtype = { "text": str, "category": str, "n_resource_keys": np.int8, "n_words": np.int8, "length": np.int8 })
             except Exception as e:
                 print("Failed to open {} ({})".format(csv_file, e))
                 return
 
         # load previously generated tokenizer, or create new one
 
-        if os.path.isfile(self.tokenizer_file):
-            with open(self.tokenizer_file, "rb") as f:
-                self.tokenizer = pickle.load(f)
-        else:
-            self.tokenizer = Tokenizer(num_words = self.num_words, filters = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n', lower = True)
-            self.tokenizer.fit_on_texts(self.df['text'].values)
-
-            with open(self.tokenizer_file, 'wb') as f:
-                pickle.dump(self.tokenizer, f, pickle.HIGHEST_PROTOCOL)
-
-            self.word_index = self.tokenizer.word_index
+        self.tokenizer = load_tokenizer(cache_dir, self.num_words, lambda: [self.df['text'].values])
+        self.word_index = self.tokenizer.word_index
 
         if self.df is not None:
-            # create onehot-vectors for classification in deep learning network
+            from sklearn.model_selection import train_test_split
+            from sklearn.utils import shuffle
+
+            self.df['label'] = 0
+            self.df.loc[self.df['category'] == 'find_resource', 'label'] = 1
 
             if self.use_tokenizer:
-                self.df['label'] = 0
-                self.df.loc[self.df['category'] == 'chat', 'label'] = 0
-                self.df.loc[self.df['category'] == 'find_resource', 'label'] = 1
+                # padded sequences and onehot-vectors for the deep learning network,
+                # from the tensor cache if csv file and tokenizer did not change
 
-                self.Y = to_categorical(self.df['label'], num_classes = 2)
+                self.X, self.Y = self.load_tensors(cache_dir, csv_file)
             else:
+                self.X = self.df['text'].values
                 self.Y = self.df['category'].values
 
-            # use tokenizer to prepare/normalize text input
-
-            self.X = self.prepare_array(self.df['text'].values)
+            self.df, self.X, self.Y = shuffle(self.df, self.X, self.Y)
 
             # create/split into train/test/validation sets.
 
-            self.x_train, self.x_test, self.y_train, self.y_test = train_test_split(self.X, self.Y, test_size = 0.25)
-            self.x_train, self.x_valid, self.y_train, self.y_valid = train_test_split(self.x_train, self.y_train, test_size = 0.2)
+            # rows_* are the matching row positions in df (see get_texts)
 
-    def get_input_shape(self):
-        if self.df is None:
-            return (130,)
+            rows = np.arange(len(self.df))
+
+            self.x_train, self.x_test, self.y_train, self.y_test, self.rows_train, self.rows_test = train_test_split(self.X, self.Y, rows, test_size = 0.25)
+            self.x_train, self.x_valid, self.y_train, self.y_valid, self.rows_train, self.rows_valid = train_test_split(self.x_train, self.y_train, self.rows_train, test_size = 0.2)
+
+    # -------------------------------------------------------------------------
+    # load_tensors
+    #
+    # X (padded sequences) and Y (onehot labels) of the csv file, in file order.
+    # they are cached as .npy files in cache_dir/chat_tensors, keyed by the
+    # content hashes of csv file and tokenizer, maxlen and num_words.
+
+    def load_tensors(self, cache_dir, csv_file):
+        tensor_dir = cache_dir + "/chat_tensors"
+        key = "{}-{}-{}-{}".format(file_hash(csv_file), file_hash(self.tokenizer_file), self.maxlen, self.num_words)
+
+        try:
+            with open(tensor_dir + "/meta.json") as f:
+                meta = json.load(f)
+
+            if meta["key"] == key:
+                return np.load(tensor_dir + "/x.npy", mmap_mode = "r"), np.load(tensor_dir + "/y.npy", mmap_mode = "r")
+        except Exception as e:
+            pass
+
+        from keras.utils.np_utils import to_categorical
+
+        x = self.prepare_array(self.df['text'].values)
+        y = to_categorical(self.df['label'], num_classes = 2)
 
-        return (self.x_train.shape[1], )
+        # write to a temporary directory first, so an interrupted run leaves no half cache
+
+        tmp_dir = tensor_dir + ".tmp"
+
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+        os.makedirs(tmp_dir)
+
+        np.save(tmp_dir + "/x.npy", x)
+        np.save(tmp_dir + "/y.npy", y)
+
+        with open(tmp_dir + "/meta.json", "w") as f:
+            json.dump({ "key": key, "rows": len(x) }, f)
+
+        shutil.rmtree(tensor_dir, ignore_errors = True)
+        os.replace(tmp_dir, tensor_dir)
+
+        return x, y
+
+    def get_input_shape(self):
+        return (None,)
 
     def get_input_dim(self):
         return self.num_words
 
+    def get_num_tokens(self):
+        return min(self.num_words, len(self.tokenizer.word_index) + 1)
+
+    def get_texts(self, rows):
+        return self.df['text'].values[rows], self.df['category'].values[rows]
+
     def get_num_classes(self):
         return self.num_classes
 
@@ -182,14 +382,20 @@ class Dataset:
     def get_classes(self):
         return ["chat", "find_resource"]
 
-    def prepare_array(self, texts):
+    def prepare_array(self, texts, bucketed = False, reuse = False):
         if self.use_tokenizer:
+            from keras.preprocessing.sequence import pad_sequences
+
             sequences = self.tokenizer.texts_to_sequences(texts)
-            return pad_sequences(sequences, maxlen = self.maxlen)
+            length = get_padded_length(sequences, self.maxlen) if bucketed else self.maxlen
+
+            return pad_sequences(sequences, maxlen = length)
 
         return texts
 
     def hist(self, columns = None):
+        import matplotlib.pyplot as plt
+
         if columns is not None:
             self.df.hist(column = columns, bins = 100)
         else:
@@ -198,5 +404,461 @@ class Dataset:
         plt.show()
 
     def hist_text(self, column):
+        import pandas as pd
+        import matplotlib.pyplot as plt
+
         pd.Series(self.df[column]).value_counts().plot('bar')
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+# -----------------------------------------------------------------------------
+# class StreamingDataset
+# -----------------------------------------------------------------------------
+#
+# training input for corpora too large for Dataset. the csv file is read in
+# chunks and tokenized once into a sequence store on disk (cache_dir/
+# chat_sequences): the token ids of all rows back to back (int32), the row
+# offsets, labels and the train/valid/test assignment of every row, plus the
+# texts (utf-8, back to back) for the SGD classifier. the store is rebuilt
+# when the csv file or the tokenizer changes (content hashes).
+#
+# all arrays are memory mapped. batches are padded when they are created, the
+# shuffling batch generator only holds shuffle_blocks blocks of row numbers,
+# so memory does not grow with the corpus.
+
+SPLITS = { "train": 0, "valid": 1, "test": 2 }
+
+class StreamingDataset:
+    streaming = True
+    store_version = 2
+
+    # -------------------------------------------------------------------------
+    # ctor
+
+    def __init__(self, cache_dir, csv_file, num_words = 10000, maxlen = 130, chunk_size = 10000, block_size = 1024, 
+                 shuffle_blocks = 64, test_size = 0.25, valid_size = 0.2):
+        self.num_classes = 2
+        self.model_name = "chat_classification.h5"
+        self.num_words = num_words
+        self.maxlen = maxlen
+        self.csv_file = csv_file
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.shuffle_blocks = shuffle_blocks
+        self.store_dir = cache_dir + "/chat_sequences"
+        self.rng = np.random.RandomState()
+        self.meta = None
+
+        try:
+            self.tokenizer = load_tokenizer(cache_dir, self.num_words, lambda: (texts for texts, categories in self.read_csv_chunks()))
+            self.word_index = self.tokenizer.word_index
+
+            key = "{}-{}-{}".format(self.store_version, file_hash(csv_file), file_hash(cache_dir + '/chat_classification.tokenizer'))
+
+            self.meta = self.load_store(key)
+
+            if self.meta is None:
+                self.meta = self.build_store(key, test_size, valid_size)
+        except Exception as e:
+            print("Failed to open {} ({})".format(csv_file, e))
+            return
+
+        self.tokens = self.open_array("tokens", np.int32)
+        self.offsets = self.open_array("offsets", np.int64)
+        self.labels = self.open_array("labels", np.int8)
+        self.splits = self.open_array("splits", np.int8)
+        self.texts = self.open_array("texts", np.uint8)
+        self.text_offsets = self.open_array("text_offsets", np.int64)
+
+    # -------------------------------------------------------------------------
+    # read_csv_chunks (yields arrays of texts and categories)
+
+    def read_csv_chunks(self):
+        import pandas as pd
+
+        for chunk in pd.read_csv(self.csv_file, usecols = ["text", "category"], dtype = str, keep_default_na = False, 
+                                 chunksize = self.chunk_size):
+            yield chunk["text"].values, chunk["category"].values
+
+    # -------------------------------------------------------------------------
+    # load_store (meta data of the sequence store, None if missing/outdated)
+
+    def load_store(self, key):
+        try:
+            with open(self.store_dir + "/meta.json") as f:
+                meta = json.load(f)
+        except Exception as e:
+            return None
+
+        if meta.get("key") != key:
+            return None
+
+        return meta
+
+    # -------------------------------------------------------------------------
+    # build_store (tokenize the csv file chunk by chunk)
+
+    def build_store(self, key, test_size, valid_size):
+        tmp_dir = self.store_dir + ".tmp"
+        classes = self.get_classes()
+        rng = np.random.RandomState(0)
+        counts = { name: 0 for name in SPLITS }
+        num_rows = 0
+        num_tokens = 0
+        num_bytes = 0
+
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+        os.makedirs(tmp_dir)
+
+        with open(tmp_dir + "/tokens", "wb") as tokens_file, open(tmp_dir + "/offsets", "wb") as offsets_file, \
+             open(tmp_dir + "/labels", "wb") as labels_file, open(tmp_dir + "/splits", "wb") as splits_file, \
+             open(tmp_dir + "/texts", "wb") as texts_file, open(tmp_dir + "/text_offsets", "wb") as text_offsets_file:
+
+            offsets_file.write(np.zeros(1, dtype = np.int64).tobytes())
+            text_offsets_file.write(np.zeros(1, dtype = np.int64).tobytes())
+
+            for texts, categories in self.read_csv_chunks():
+                sequences = self.tokenizer.texts_to_sequences(texts)
+                lengths = np.array([len(seq) for seq in sequences], dtype = np.int64)
+
+                # same split ratios as Dataset (test_size of all rows, valid_size of the rest)
+
+                draw = rng.random_sample(len(texts))
+                splits = np.where(draw < test_size, SPLITS["test"], 
+                                  np.where(draw < test_size + (1.0 - test_size) * valid_size, SPLITS["valid"], SPLITS["train"]))
+
+                tokens_file.write(np.fromiter((token for seq in sequences for token in seq), dtype = np.int32, 
+                                              count = int(lengths.sum())).tobytes())
+                offsets_file.write((num_tokens + np.cumsum(lengths)).tobytes())
+                labels_file.write(np.array([classes.index(c) if c in classes else 0 for c in categories], dtype = np.int8).tobytes())
+                splits_file.write(splits.astype(np.int8).tobytes())
+
+                encoded = [text.encode("utf-8") for text in texts]
+                sizes = np.array([len(text) for text in encoded], dtype = np.int64)
+
+                texts_file.write(b"".join(encoded))
+                text_offsets_file.write((num_bytes + np.cumsum(sizes)).tobytes())
+                num_bytes += int(sizes.sum())
+
+                for name, code in SPLITS.items():
+                    counts[name] += int((splits == code).sum())
+
+                num_rows += len(texts)
+                num_tokens += int(lengths.sum())
+
+        meta = { "key": key, "rows": num_rows, "tokens": num_tokens, "counts": counts }
+
+        with open(tmp_dir + "/meta.json", "w") as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(self.store_dir, ignore_errors = True)
+        os.replace(tmp_dir, self.store_dir)
+
+        return meta
+
+    # -------------------------------------------------------------------------
+    # open_array (read-only memory map of one of the store's files)
+
+    def open_array(self, name, dtype):
+        file_name = self.store_dir + "/" + name
+
+        if os.path.getsize(file_name) == 0:
+            return np.zeros(0, dtype = dtype)
+
+        return np.memmap(file_name, dtype = dtype, mode = "r")
+
+    # -------------------------------------------------------------------------
+    # get_num_rows / get_num_batches (of a split)
+
+    def get_num_rows(self, split):
+        return self.meta["counts"][split]
+
+    def get_num_batches(self, split, batch_size):
+        return (self.get_num_rows(split) + batch_size - 1) // batch_size
+
+    # -------------------------------------------------------------------------
+    # get_rows (row numbers of a split within block number block)
+
+    def get_rows(self, split, block):
+        start = block * self.block_size
+
+        return start + np.flatnonzero(self.splits[start:start + self.block_size] == SPLITS[split])
+
+    # -------------------------------------------------------------------------
+    # get_batch (padded like prepare_array, one-hot labels)
+
+    def get_batch(self, rows):
+        x = np.zeros((len(rows), self.maxlen), dtype = np.int32)
+
+        for i, row in enumerate(rows):
+            start = max(self.offsets[row], self.offsets[row + 1] - self.maxlen)
+            seq = self.tokens[start:self.offsets[row + 1]]
+
+            if len(seq):
+                x[i, -len(seq):] = seq
+
+        y = np.eye(self.num_classes, dtype = np.float32)[self.labels[rows]]
+
+        return x, y
+
+    # -------------------------------------------------------------------------
+    # generate_row_batches
+    #
+    # yields arrays of row numbers of a split, batch_size rows each (the last
+    # one may be shorter), loop = True repeats forever. with shuffle, the
+    # blocks are visited in random order and the rows of shuffle_blocks blocks
+    # at a time are shuffled before they are batched.
+
+    def generate_row_batches(self, split, batch_size, shuffle = False, loop = False):
+        num_blocks = (self.meta["rows"] + self.block_size - 1) // self.block_size
+
+        while True:
+            order = self.rng.permutation(num_blocks) if shuffle else np.arange(num_blocks)
+            pending = np.zeros(0, dtype = np.int64)
+
+            for start in range(0, num_blocks, self.shuffle_blocks):
+                rows = np.concatenate([pending] + [self.get_rows(split, block) for block in order[start:start + self.shuffle_blocks]])
+
+                if shuffle:
+                    self.rng.shuffle(rows)
+
+                full = len(rows) - len(rows) % batch_size
+
+                for i in range(0, full, batch_size):
+                    yield rows[i:i + batch_size]
+
+                pending = rows[full:]
+
+            if len(pending):
+                yield pending
+
+            if not loop:
+                return
+
+    # -------------------------------------------------------------------------
+    # generate_batches (yields padded (x, y) batches, see generate_row_batches)
+
+    def generate_batches(self, split, batch_size, shuffle = False, loop = False):
+        for rows in self.generate_row_batches(split, batch_size, shuffle = shuffle, loop = loop):
+            yield self.get_batch(rows)
+
+    # -------------------------------------------------------------------------
+    # get_sample
+    #
+    # x, y of max_rows rows of a split from randomly chosen blocks. the csv file
+    # is ordered by source (all chat sentences first), so the leading rows
+    # would not be representative. seeded, so repeated calls return the same
+    # sample.
+
+    def get_sample(self, split, max_rows, seed = 0):
+        num_blocks = (self.meta["rows"] + self.block_size - 1) // self.block_size
+        rows = []
+        num_rows = 0
+
+        for block in np.random.RandomState(seed).permutation(num_blocks):
+            if num_rows >= max_rows:
+                break
+
+            rows.append(self.get_rows(split, block))
+            num_rows += len(rows[-1])
+
+        rows = np.concatenate(rows)[:max_rows] if rows else np.zeros(0, dtype = np.int64)
+
+        return self.get_batch(rows)
+
+    # -------------------------------------------------------------------------
+    # get_texts (texts and categories of the given rows, like Dataset.get_texts)
+
+    def get_texts(self, rows):
+        classes = self.get_classes()
+        texts = np.array([bytes(self.texts[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8") for row in rows], 
+                         dtype = object)
+        categories = np.array([classes[label] for label in self.labels[rows]], dtype = object)
+
+        return texts, categories
+
+    def get_input_shape(self):
+        return (None,)
+
+    def get_input_dim(self):
+        return self.num_words
+
+    def get_num_tokens(self):
+        return min(self.num_words, len(self.tokenizer.word_index) + 1)
+
+    def get_num_classes(self):
+        return self.num_classes
+
+    def get_model_filename(self):
+        return self.model_name        
+
+    def get_classes(self):
+        return ["chat", "find_resource"]
+
+    def prepare_array(self, texts, bucketed = False, reuse = False):
+        from keras.preprocessing.sequence import pad_sequences
+
+        sequences = self.tokenizer.texts_to_sequences(texts)
+        length = get_padded_length(sequences, self.maxlen) if bucketed else self.maxlen
+
+        return pad_sequences(sequences, maxlen = length)
+
+# -----------------------------------------------------------------------------
+# class TokenizerState - attributes of a pickled keras Tokenizer
+# -----------------------------------------------------------------------------
+
+class TokenizerState:
+    pass
+
+class TokenizerUnpickler(pickle.Unpickler):
+    allowed = { ("collections", "OrderedDict"): collections.OrderedDict,
+                ("collections", "defaultdict"): collections.defaultdict,
+                ("builtins", "int"): int,
+                ("keras_preprocessing.text", "Tokenizer"): TokenizerState,
+                ("keras.preprocessing.text", "Tokenizer"): TokenizerState }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.allowed:
+            raise pickle.UnpicklingError("Unexpected class {}.{} in tokenizer file".format(module, name))
+
+        return self.allowed[(module, name)]
+
+# -----------------------------------------------------------------------------
+# class InferenceDataset
+# -----------------------------------------------------------------------------
+#
+# lightweight replacement for Dataset when serving. only provides what the
+# classifier needs at inference time (tokenizing/padding, shapes, classes) and
+# does not depend on keras, pandas or sklearn.
+#
+# the vocabulary is read from a compact json file holding only the words the
+# tokenizer can actually emit (index < num_words). it is created from the
+# keras tokenizer file on first use.
+
+class InferenceDataset:
+    vocabulary_name = "chat_classification.vocab"
+
+    # -------------------------------------------------------------------------
+    # ctor
+
+    def __init__(self, cache_dir, num_words = 10000, maxlen = 130):
+        self.num_classes = 2
+        self.model_name = "chat_classification.h5"
+        self.num_words = num_words
+        self.maxlen = maxlen
+        self.tokenizer_file = cache_dir + '/chat_classification.tokenizer'
+        self.vocabulary_file = cache_dir + '/' + self.vocabulary_name
+        self.buffers = threading.local()
+
+        if (not os.path.isfile(self.vocabulary_file) 
+            or (os.path.isfile(self.tokenizer_file) and os.path.getmtime(self.tokenizer_file) > os.path.getmtime(self.vocabulary_file))):
+            with open(self.tokenizer_file, "rb") as f:
+                state = TokenizerUnpickler(f).load()
+
+            InferenceDataset.write_vocabulary(state, self.vocabulary_file)
+
+        with open(self.vocabulary_file) as f:
+            vocabulary = json.load(f)
+
+        self.lower = vocabulary["lower"]
+        self.split = vocabulary["split"]
+        self.oov_index = vocabulary["oov_index"]
+        self.filter_table = str.maketrans({ c: self.split for c in vocabulary["filters"] })
+        self.word_index = { word: i + 1 for i, word in enumerate(vocabulary["words"]) if word is not None }
+        self.num_tokens = len(vocabulary["words"]) + 1
+
+    # -------------------------------------------------------------------------
+    # write_vocabulary (from a keras Tokenizer or TokenizerState)
+
+    def write_vocabulary(tokenizer, file_name):
+        num_words = tokenizer.num_words or (len(tokenizer.word_index) + 1)
+        words = [None] * (min(num_words, len(tokenizer.word_index) + 1) - 1)
+
+        for word, i in tokenizer.word_index.items():
+            if i < num_words:
+                words[i - 1] = word
+
+        oov_index = None
+
+        if tokenizer.oov_token is not None:
+            oov_index = tokenizer.word_index.get(tokenizer.oov_token)
+
+        with open(file_name, "w") as f:
+            json.dump({ "num_words": num_words, "filters": tokenizer.filters, "lower": tokenizer.lower, 
+                        "split": tokenizer.split, "oov_index": oov_index, "words": words }, f, ensure_ascii = False)
+
+    # -------------------------------------------------------------------------
+    # texts_to_sequences (same results as keras Tokenizer.texts_to_sequences)
+
+    def texts_to_sequences(self, texts):
+        res = []
+
+        for text in texts:
+            if self.lower:
+                text = text.lower()
+
+            seq = []
+
+            for word in text.translate(self.filter_table).split(self.split):
+                if not word:
+                    continue
+
+                i = self.word_index.get(word)
+
+                if i is not None:
+                    seq.append(i)
+                elif self.oov_index is not None:
+                    seq.append(self.oov_index)
+
+            res.append(seq)
+
+        return res
+
+    # -------------------------------------------------------------------------
+    # prepare_array
+    #
+    # pads/truncates like keras pad_sequences (both 'pre'), to maxlen or, with
+    # bucketed, to get_padded_length. with reuse (serving hot path), the result
+    # is a view into a per-thread buffer which is overwritten by the next call
+    # and must not be kept.
+
+    def prepare_array(self, texts, bucketed = False, reuse = False):
+        sequences = self.texts_to_sequences(texts)
+        length = get_padded_length(sequences, self.maxlen) if bucketed else self.maxlen
+
+        if reuse:
+            buffer = getattr(self.buffers, "buffer", None)
+
+            if buffer is None or len(buffer) < len(sequences) * self.maxlen:
+                buffer = np.zeros(max(len(sequences), 32) * self.maxlen, dtype = np.int32)
+                self.buffers.buffer = buffer
+
+            res = buffer[:len(sequences) * length].reshape(len(sequences), length)
+            res.fill(0)
+        else:
+            res = np.zeros((len(sequences), length), dtype = np.int32)
+
+        for row, seq in enumerate(sequences):
+            seq = seq[-length:]
+
+            if seq:
+                res[row, length - len(seq):] = seq
+
+        return res
+
+    def get_input_shape(self):
+        return (None,)
+
+    def get_input_dim(self):
+        return self.num_words
+
+    def get_num_tokens(self):
+        return self.num_tokens
+
+    def get_num_classes(self):
+        return self.num_classes
+
+    def get_model_filename(self):
+        return self.model_name
+
+    def get_classes(self):
+        return ["chat", "find_resource"]
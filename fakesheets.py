@@ -0,0 +1,86 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# fakesheets.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import copy
+import json
+
+# -----------------------------------------------------------------------------
+# class FakeSheetsService
+#
+# local stand-in for the google sheets v4 service object, covering the calls
+# used by SheetsCache. can be assigned to SheetsCache.service, e.g.:
+#
+#   shts.service = FakeSheetsService({ "A1 (Tundra)": [["Res", "Island1"], ["Silver/Silber", "TRUE"]] })
+#   shts.reload_cache()
+# -----------------------------------------------------------------------------
+
+class FakeSheetsService:
+
+    # -------------------------------------------------------------------------
+    # ctor
+    #
+    # tabs: dict of sheet name -> list of rows (list of cell strings)
+
+    def __init__(self, tabs = None):
+        self.tabs = dict(tabs or {})
+        self.requests = []
+
+    # -------------------------------------------------------------------------
+    # from_file (json file containing the tabs dict)
+
+    def from_file(file_name):
+        with open(file_name) as f:
+            return FakeSheetsService(json.load(f))
+
+    # -------------------------------------------------------------------------
+    # set_tab / remove_tab
+
+    def set_tab(self, name, rows):
+        self.tabs[name] = rows
+
+    def remove_tab(self, name):
+        del self.tabs[name]
+
+    # -------------------------------------------------------------------------
+    # service api
+
+    def spreadsheets(self):
+        return FakeSpreadsheets(self)
+
+class FakeRequest:
+    def __init__(self, service, name, result):
+        self.service = service
+        self.name = name
+        self.result = result
+
+    def execute(self):
+        self.service.requests.append(self.name)
+        return copy.deepcopy(self.result)
+
+class FakeSpreadsheets:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, **kwargs):
+        return FakeRequest(self.service, "get", { "sheets": [{ "properties": { "title": name } } for name in self.service.tabs] })
+
+    def values(self):
+        return FakeValues(self.service)
+
+class FakeValues:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, spreadsheetId, range, **kwargs):
+        return FakeRequest(self.service, "values.get", { "range": range, "values": self.service.tabs[range] })
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        return FakeRequest(self.service, "values.batchGet", 
+                           { "valueRanges": [{ "range": name, "values": self.service.tabs[name] } for name in ranges] })
@@ -0,0 +1,105 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# locations.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import sys
+from array import array
+
+# -----------------------------------------------------------------------------
+# class LocationStore
+#
+# struct-of-arrays store of resource locations (grid/island/cell/availability).
+# grid and island names are interned and referenced by id, availability is kept
+# in bitmaps. records are referenced by their id (position in the store), so
+# the english and german resource maps share the same records.
+# -----------------------------------------------------------------------------
+
+class LocationStore:
+
+    __slots__ = ["grid_names", "grid_ids", "island_names", "island_ids", 
+                 "grids", "islands", "cols", "rows", "avail", "unavail", "size"]
+
+    # -------------------------------------------------------------------------
+    # ctor
+
+    def __init__(self):
+        self.grid_names = []
+        self.grid_ids = {}
+        self.island_names = []
+        self.island_ids = {}
+
+        self.grids = array("H")
+        self.islands = array("I")
+        self.cols = array("H")
+        self.rows = array("I")
+
+        # bit set: cell is 'TRUE' (avail) / 'FALSE' (unavail)
+
+        self.avail = bytearray()
+        self.unavail = bytearray()
+        self.size = 0
+
+    # -------------------------------------------------------------------------
+    # add (returns the id of the new record)
+
+    def add(self, grid, island, col, row, avail):
+        rid = self.size
+
+        self.grids.append(self.intern(grid, self.grid_names, self.grid_ids))
+        self.islands.append(self.intern(island, self.island_names, self.island_ids))
+        self.cols.append(col)
+        self.rows.append(row)
+
+        if rid % 8 == 0:
+            self.avail.append(0)
+            self.unavail.append(0)
+
+        if avail == "TRUE":
+            self.avail[rid >> 3] |= 1 << (rid & 7)
+        elif avail == "FALSE":
+            self.unavail[rid >> 3] |= 1 << (rid & 7)
+
+        self.size += 1
+        return rid
+
+    def intern(self, name, names, ids):
+        res = ids.get(name)
+
+        if res is None:
+            res = len(names)
+            names.append(sys.intern(name))
+            ids[name] = res
+
+        return res
+
+    # -------------------------------------------------------------------------
+    # accessors
+
+    def is_available(self, rid):
+        return (self.avail[rid >> 3] >> (rid & 7)) & 1 == 1
+
+    def is_unavailable(self, rid):
+        return (self.unavail[rid >> 3] >> (rid & 7)) & 1 == 1
+
+    def grid(self, rid):
+        return self.grid_names[self.grids[rid]]
+
+    def island(self, rid):
+        return self.island_names[self.islands[rid]]
+
+    def cell(self, rid):
+        return chr(ord('A') + self.cols[rid]) + str(self.rows[rid])
+
+    def record(self, rid):
+        avail = "TRUE" if self.is_available(rid) else "FALSE" if self.is_unavailable(rid) else ""
+
+        return { "grid": self.grid(rid), "island": self.island(rid), "cell": self.cell(rid), "avail": avail }
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,117 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# matcher.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+from collections import deque
+
+# -----------------------------------------------------------------------------
+# class KeywordMatcher - Aho-Corasick multi-pattern automaton
+# -----------------------------------------------------------------------------
+
+class KeywordMatcher:
+
+    # -------------------------------------------------------------------------
+    # ctor
+    #
+    # patterns: iterable of (pattern, payload) tuples. the same pattern may be
+    #           given multiple times with different payloads. empty patterns
+    #           are ignored. the automaton is not modified after construction.
+
+    def __init__(self, patterns):
+        goto = [{}]
+        outputs = [[]]
+
+        # (1) build the trie
+
+        for pattern, payload in patterns:
+            if not pattern:
+                continue
+
+            node = 0
+
+            for char in pattern:
+                nxt = goto[node].get(char)
+
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][char] = nxt
+                    goto.append({})
+                    outputs.append([])
+
+                node = nxt
+
+            outputs[node].append((len(pattern), payload))
+
+        # (2) compute failure links breadth first and merge outputs of suffixes
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+
+        while queue:
+            node = queue.popleft()
+
+            for char, nxt in goto[node].items():
+                queue.append(nxt)
+                state = fail[node]
+
+                while state and char not in goto[state]:
+                    state = fail[state]
+
+                fallback = goto[state].get(char, 0)
+                fail[nxt] = fallback if fallback != nxt else 0
+                outputs[nxt].extend(outputs[fail[nxt]])
+
+        self.goto = goto
+        self.fail = fail
+        self.outputs = [tuple(out) for out in outputs]
+        self.num_patterns = sum(len(out) for out in outputs)
+
+    # -------------------------------------------------------------------------
+    # find_all
+    #
+    # single pass over text, returns a list of (start, end, payload) for every
+    # (possibly overlapping) occurrence of every pattern.
+
+    def find_all(self, text):
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        res = []
+        node = 0
+
+        for pos, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+
+            node = goto[node].get(char, 0)
+
+            for length, payload in outputs[node]:
+                res.append((pos + 1 - length, pos + 1, payload))
+
+        return res
+
+    # -------------------------------------------------------------------------
+    # contains (stops at the first occurrence of any pattern)
+
+    def contains(self, text):
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        node = 0
+
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+
+            node = goto[node].get(char, 0)
+
+            if outputs[node]:
+                return True
+
+        return False
@@ -0,0 +1,295 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# metrics.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import asyncio
+import logging
+import time
+
+from threading import Lock, Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -----------------------------------------------------------------------------
+# globals
+#
+# metrics are only recorded after enable() was called. until then, every
+# update returns right after checking the flag.
+# -----------------------------------------------------------------------------
+
+enabled = False
+registry = []
+registry_mutex = Lock()
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def enable():
+    global enabled
+    enabled = True
+
+def is_enabled():
+    return enabled
+
+# -----------------------------------------------------------------------------
+# class Metric (base)
+# -----------------------------------------------------------------------------
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, description, labelnames = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.mutex = Lock()
+        self.values = {}
+
+        with registry_mutex:
+            registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def format_labels(self, key, extra = None):
+        pairs = list(zip(self.labelnames, key))
+
+        if extra is not None:
+            pairs.append(extra)
+
+        if not pairs:
+            return ""
+
+        return "{" + ",".join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + "}"
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} {}".format(self.name, self.kind)]
+
+        with self.mutex:
+            samples = sorted(self.values.items())
+
+        for key, value in samples:
+            lines.append("{}{} {}".format(self.name, self.format_labels(key), format_value(value)))
+
+        return lines
+
+# -----------------------------------------------------------------------------
+# class Counter
+# -----------------------------------------------------------------------------
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount = 1, **labels):
+        if not enabled:
+            return
+
+        key = self.key(labels)
+
+        with self.mutex:
+            self.values[key] = self.values.get(key, 0) + amount
+
+# -----------------------------------------------------------------------------
+# class Gauge
+#
+# either set explicitly, or computed when rendered (set_function, func returns
+# a number, or a dict of label tuple -> number for labelled gauges)
+# -----------------------------------------------------------------------------
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, description, labelnames = (), kind = "gauge"):
+        Metric.__init__(self, name, description, labelnames)
+        self.kind = kind
+        self.func = None
+
+    def set(self, value, **labels):
+        if not enabled:
+            return
+
+        key = self.key(labels)
+
+        with self.mutex:
+            self.values[key] = value
+
+    def set_function(self, func):
+        self.func = func
+
+    def render(self):
+        if self.func is not None:
+            try:
+                res = self.func()
+            except Exception as e:
+                res = {}
+
+            if not isinstance(res, dict):
+                res = { (): res }
+
+            with self.mutex:
+                self.values = { tuple(str(v) for v in key): value for key, value in res.items() }
+
+        return Metric.render(self)
+
+# -----------------------------------------------------------------------------
+# class Histogram
+# -----------------------------------------------------------------------------
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames = (), buckets = DEFAULT_BUCKETS):
+        Metric.__init__(self, name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not enabled:
+            return
+
+        key = self.key(labels)
+
+        with self.mutex:
+            entry = self.values.get(key)
+
+            if entry is None:
+                entry = [[0] * len(self.buckets), 0, 0.0]
+                self.values[key] = entry
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+
+            entry[1] += 1
+            entry[2] += value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} {}".format(self.name, self.kind)]
+
+        with self.mutex:
+            samples = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self.values.items())
+
+        for key, (counts, count, total) in samples:
+            cumulative = 0
+
+            for bound, num in zip(self.buckets, counts):
+                cumulative += num
+                lines.append("{}_bucket{} {}".format(self.name, self.format_labels(key, ("le", format_value(bound))), cumulative))
+
+            lines.append("{}_bucket{} {}".format(self.name, self.format_labels(key, ("le", "+Inf")), count))
+            lines.append("{}_sum{} {}".format(self.name, self.format_labels(key), format_value(total)))
+            lines.append("{}_count{} {}".format(self.name, self.format_labels(key), count))
+
+        return lines
+
+# -----------------------------------------------------------------------------
+# render (prometheus text exposition format)
+# -----------------------------------------------------------------------------
+
+def render():
+    with registry_mutex:
+        metrics = list(registry)
+
+    lines = []
+
+    for metric in metrics:
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
+
+# -----------------------------------------------------------------------------
+# monitor_loop_lag
+#
+# sleeps interval seconds over and over, anything beyond that is time the
+# event loop was blocked (e.g. by CPU work not handed to the worker pool)
+# -----------------------------------------------------------------------------
+
+async def monitor_loop_lag(interval = 0.5):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
+
+# -----------------------------------------------------------------------------
+# class MetricsServer
+# -----------------------------------------------------------------------------
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = render().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer(Thread):
+
+    # -------------------------------------------------------------------------
+    # ctor
+
+    def __init__(self, port, host = "127.0.0.1"):
+        Thread.__init__(self, daemon = True)
+
+        self.log = logging.getLogger(__name__)
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+
+    # -------------------------------------------------------------------------
+    # run
+
+    def run(self):
+        host, port = self.server.server_address[:2]
+
+        self.log.info("Serving metrics on http://{}:{}/metrics".format(host, port))
+        self.server.serve_forever()
+
+    # -------------------------------------------------------------------------
+    # stop
+
+    def stop(self):
+        self.server.shutdown()
+
+# -----------------------------------------------------------------------------
+# metrics
+# -----------------------------------------------------------------------------
+
+message_stage = Histogram("larb_message_stage_seconds", "Time spent per message in each on_message stage", ["stage"])
+messages = Counter("larb_messages_total", "Received messages by keyword gate result", ["gate"])
+classifications = Counter("larb_classifications_total", "Classified sentences by label", ["label"])
+classifier_fallback = Counter("larb_classifier_fallback_total", "Sentences where the SGD result replaced an unconfident CNN result")
+classifier_stage = Counter("larb_classifier_stage_total", "Sentences decided per classifier cascade stage", ["stage"])
+answers = Counter("larb_answers_total", "Answers sent")
+sheets_reload = Histogram("larb_sheets_reload_seconds", "Duration of sheets reloads", ["result"],
+                          buckets = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+sheets_version = Gauge("larb_sheets_snapshot_version", "Version of the current sheets snapshot")
+sheets_resources = Gauge("larb_sheets_resources", "Number of resources in the current sheets snapshot")
+cache_entries = Gauge("larb_cache_entries", "Number of cached entries", ["cache"])
+cache_lookups = Gauge("larb_cache_lookups_total", "Cache lookups by result", ["cache", "result"], kind = "counter")
+batch_queue = Gauge("larb_batch_queue_depth", "Items waiting for the next batch", ["batcher"])
+loop_lag = Histogram("larb_event_loop_lag_seconds", "Delay of the asyncio event loop",
+                     buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+loop_lag_last = Gauge("larb_event_loop_lag_last_seconds", "Last measured delay of the asyncio event loop")
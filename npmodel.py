@@ -0,0 +1,189 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# npmodel.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# export_keras_model
+#
+# freezes the weights of a trained RNN variant 4 model (Embedding, Conv1D,
+# GlobalMaxPooling1D, BatchNormalization, Dense, BatchNormalization, Dense)
+# into a .npz file which can be served by NumpyCNN without tensorflow.
+# -----------------------------------------------------------------------------
+
+def export_keras_model(model, file_name):
+    layers = [layer for layer in model.layers if layer.get_weights()]
+    kinds = [type(layer).__name__ for layer in layers]
+    expected = ["Embedding", "Conv1D", "BatchNormalization", "Dense", "BatchNormalization", "Dense"]
+
+    if kinds != expected:
+        raise ValueError("Cannot export model with layers {}, only the Conv1D variant (4) is supported".format(", ".join(kinds)))
+
+    embedding, conv, bn1, dense, bn2, out = layers
+    weights = { "embedding": embedding.get_weights()[0] }
+
+    weights["conv_kernel"], weights["conv_bias"] = conv.get_weights()
+    weights["dense_kernel"], weights["dense_bias"] = dense.get_weights()
+    weights["out_kernel"], weights["out_bias"] = out.get_weights()
+
+    for prefix, bn in [("bn1", bn1), ("bn2", bn2)]:
+        gamma, beta, mean, var = bn.get_weights()
+
+        weights[prefix + "_gamma"] = gamma
+        weights[prefix + "_beta"] = beta
+        weights[prefix + "_mean"] = mean
+        weights[prefix + "_var"] = var
+        weights[prefix + "_epsilon"] = np.array(bn.epsilon, dtype = np.float32)
+
+    np.savez(file_name, **{ name: np.asarray(value, dtype = np.float32) for name, value in weights.items() })
+
+# -----------------------------------------------------------------------------
+# load_folded_weights
+#
+# loads an exported float model. inference-time batch normalization is an
+# affine transform, so it is folded into the following dense layer:
+# (h * s + t) @ W + b = h @ (s * W) + (t @ W + b)
+# -----------------------------------------------------------------------------
+
+def load_folded_weights(file_name):
+    with np.load(file_name) as weights:
+        res = { "embedding": weights["embedding"], 
+                "conv_kernel": weights["conv_kernel"], 
+                "conv_bias": weights["conv_bias"] }
+
+        res["dense_kernel"], res["dense_bias"] = fold(weights, "bn1", weights["dense_kernel"], weights["dense_bias"])
+        res["out_kernel"], res["out_bias"] = fold(weights, "bn2", weights["out_kernel"], weights["out_bias"])
+
+    return res
+
+def fold(weights, prefix, kernel, bias):
+    scale = weights[prefix + "_gamma"] / np.sqrt(weights[prefix + "_var"] + weights[prefix + "_epsilon"])
+    shift = weights[prefix + "_beta"] - weights[prefix + "_mean"] * scale
+
+    return (scale[:, None] * kernel).astype(np.float32), (shift @ kernel + bias).astype(np.float32)
+
+# -----------------------------------------------------------------------------
+# class NumpyCNN
+# -----------------------------------------------------------------------------
+
+class NumpyCNN:
+
+    # -------------------------------------------------------------------------
+    # ctor
+    #
+    # model_path is either an exported float model (export_keras_model) or an
+    # int8 model (quantize.quantize_model). int8 embeddings stay int8 in memory
+    # and are dequantized per looked up row, the (small) conv/dense kernels are
+    # dequantized once when loading.
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.embedding = None
+        self.embedding_q = None
+        self.embedding_scale = None
+
+        with np.load(model_path) as weights:
+            quantized = "format" in weights.files and str(weights["format"]) == "int8"
+
+            if quantized:
+                self.embedding_q = weights["embedding_q"]
+                self.embedding_scale = weights["embedding_scale"]
+                self.conv_kernel = dequantize(weights["conv_kernel_q"], weights["conv_kernel_scale"])
+                self.conv_bias = weights["conv_bias"]
+                self.dense_kernel = dequantize(weights["dense_kernel_q"], weights["dense_kernel_scale"])
+                self.dense_bias = weights["dense_bias"]
+                self.out_kernel = weights["out_kernel"]
+                self.out_bias = weights["out_bias"]
+
+        if not quantized:
+            folded = load_folded_weights(model_path)
+
+            self.embedding = folded["embedding"]
+            self.conv_kernel = folded["conv_kernel"]
+            self.conv_bias = folded["conv_bias"]
+            self.dense_kernel = folded["dense_kernel"]
+            self.dense_bias = folded["dense_bias"]
+            self.out_kernel = folded["out_kernel"]
+            self.out_bias = folded["out_bias"]
+
+    # -------------------------------------------------------------------------
+    # lookup (embedding)
+
+    def lookup(self, x):
+        if self.embedding is not None:
+            return self.embedding[x]
+
+        return self.embedding_q[x].astype(np.float32) * self.embedding_scale[x]
+
+    # -------------------------------------------------------------------------
+    # get_num_bytes (memory used by the weights)
+
+    def get_num_bytes(self):
+        arrays = [self.embedding, self.embedding_q, self.embedding_scale, self.conv_kernel, self.conv_bias, 
+                  self.dense_kernel, self.dense_bias, self.out_kernel, self.out_bias]
+
+        return sum(arr.nbytes for arr in arrays if arr is not None)
+
+    # -------------------------------------------------------------------------
+    # predict_proba (x: padded token ids, shape (n, length))
+
+    def predict_proba(self, x):
+        hidden = pooled_features(self.lookup(x), self.conv_kernel, self.conv_bias)
+        hidden = np.maximum(hidden @ self.dense_kernel + self.dense_bias, 0.0)
+        logits = hidden @ self.out_kernel + self.out_bias
+
+        logits -= logits.max(axis = 1, keepdims = True)
+        exp = np.exp(logits)
+
+        return exp / exp.sum(axis = 1, keepdims = True)
+
+    # -------------------------------------------------------------------------
+    # predict (same interface as RNN.predict)
+
+    def predict(self, texts, dataset):
+        if len(texts) == 0:
+            return []
+
+        pred = self.predict_proba(dataset.prepare_array(texts, bucketed = True, reuse = True))
+
+        classes = dataset.get_classes()
+        idx = np.argmax(pred, axis = 1)
+        acc = pred[np.arange(len(idx)), idx]
+
+        return [(classes[i], a) for i, a in zip(idx, acc)]
+
+# -----------------------------------------------------------------------------
+# pooled_features
+#
+# Conv1D (valid, stride 1) + relu + global max pooling of embedded sequences.
+# the convolution is computed as one matmul per kernel tap.
+# -----------------------------------------------------------------------------
+
+def pooled_features(emb, conv_kernel, conv_bias):
+    width = conv_kernel.shape[0]
+    steps = emb.shape[1] - width + 1
+
+    conv = emb[:, 0:steps, :] @ conv_kernel[0]
+
+    for j in range(1, width):
+        conv += emb[:, j:j + steps, :] @ conv_kernel[j]
+
+    conv += conv_bias
+
+    # max(relu(x)) == relu(max(x))
+
+    return np.maximum(conv.max(axis = 1), 0.0)
+
+# -----------------------------------------------------------------------------
+# dequantize
+# -----------------------------------------------------------------------------
+
+def dequantize(q, scale):
+    return (q.astype(np.float32) * scale).astype(np.float32)
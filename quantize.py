@@ -0,0 +1,132 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# quantize.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import time
+import logging
+import numpy as np
+
+from npmodel import NumpyCNN, load_folded_weights, pooled_features
+
+log = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# quantize_model
+#
+# post-training compression of an exported float model (export_keras_model):
+#
+# - embedding rows the tokenizer never emits (index >= num_tokens) are dropped
+# - Conv1D filters whose pooled activation is always zero on the calibration
+#   data are dropped (exact), optionally followed by the least salient
+#   prune_filters fraction (mean activation * norm of the outgoing dense
+#   weights). their mean contribution is moved into the dense bias.
+# - embedding, conv and dense kernels are stored as symmetric int8 with one
+#   scale per embedding row / output channel. the tiny output layer and all
+#   biases stay float32.
+#
+# the result is loaded by NumpyCNN like any exported model.
+# -----------------------------------------------------------------------------
+
+def quantize_model(model_path, file_name, num_tokens, x_calib, prune_filters = 0.0, batch_size = 128):
+    weights = load_folded_weights(model_path)
+
+    embedding = weights["embedding"][:max(1, num_tokens)]
+    conv_kernel = weights["conv_kernel"]
+    conv_bias = weights["conv_bias"]
+    dense_kernel = weights["dense_kernel"]
+    dense_bias = weights["dense_bias"]
+
+    # filter saliency on the calibration data
+
+    num_filters = conv_kernel.shape[2]
+    activation = np.zeros(num_filters, dtype = np.float64)
+    alive = np.zeros(num_filters, dtype = bool)
+
+    for start in range(0, len(x_calib), batch_size):
+        hidden = pooled_features(embedding[x_calib[start:start + batch_size]], conv_kernel, conv_bias)
+
+        activation += hidden.sum(axis = 0)
+        alive |= (hidden > 0.0).any(axis = 0)
+
+    activation /= max(1, len(x_calib))
+    saliency = np.where(alive, activation * np.linalg.norm(dense_kernel, axis = 1), 0.0)
+
+    num_pruned = max(int((~alive).sum()), int(num_filters * prune_filters))
+    num_pruned = min(num_pruned, num_filters - 1)
+    keep = np.sort(np.argsort(saliency)[num_pruned:])
+    dropped = np.setdiff1d(np.arange(num_filters), keep)
+
+    dense_bias = dense_bias + activation[dropped].astype(np.float32) @ dense_kernel[dropped]
+    conv_kernel = conv_kernel[:, :, keep]
+    conv_bias = conv_bias[keep]
+    dense_kernel = dense_kernel[keep]
+
+    # int8 quantization
+
+    res = { "format": np.array("int8"), "conv_bias": conv_bias, "dense_bias": dense_bias.astype(np.float32),
+            "out_kernel": weights["out_kernel"], "out_bias": weights["out_bias"] }
+
+    res["embedding_q"], res["embedding_scale"] = quantize(embedding, axis = 1)
+    res["conv_kernel_q"], res["conv_kernel_scale"] = quantize(conv_kernel, axis = (0, 1))
+    res["dense_kernel_q"], res["dense_kernel_scale"] = quantize(dense_kernel, axis = 0)
+
+    np.savez(file_name, **res)
+
+    log.info("Quantized model written to {} ({} of {} embedding rows, {} of {} filters)".format(
+        file_name, len(embedding), len(weights["embedding"]), len(keep), num_filters))
+
+    return file_name
+
+# -----------------------------------------------------------------------------
+# quantize (symmetric, one scale per slice along the axes not reduced)
+# -----------------------------------------------------------------------------
+
+def quantize(w, axis):
+    scale = np.abs(w).max(axis = axis, keepdims = True) / 127.0
+    scale[scale == 0.0] = 1.0
+
+    q = np.clip(np.round(w / scale), -127, 127).astype(np.int8)
+
+    return q, scale.astype(np.float32)
+
+# -----------------------------------------------------------------------------
+# compare_models
+#
+# accuracy, latency and size of the float and the quantized model on a held
+# out set (x: padded token ids, y: one-hot labels).
+# -----------------------------------------------------------------------------
+
+def compare_models(float_path, quantized_path, x, y, batch_size = 128):
+    labels = np.asarray(y).argmax(axis = 1)
+    res = {}
+
+    for name, path in [("float", float_path), ("int8", quantized_path)]:
+        model = NumpyCNN(path)
+        predicted = []
+
+        for start in range(0, len(x), batch_size):
+            predicted.append(model.predict_proba(x[start:start + batch_size]).argmax(axis = 1))
+
+        # per-message latency (single sentences, as served by the bot)
+
+        sample = x[:200]
+        started = time.perf_counter()
+
+        for row in sample:
+            model.predict_proba(row[None, :])
+
+        latency = (time.perf_counter() - started) / max(1, len(sample))
+
+        res[name] = { "accuracy": float((np.concatenate(predicted) == labels).mean()) if len(x) else 0.0,
+                      "latency_ms": latency * 1000.0,
+                      "memory_bytes": model.get_num_bytes(),
+                      "file_bytes": os.path.getsize(path) }
+
+    return res
@@ -8,12 +8,19 @@
 # Imports
 # -----------------------------------------------------------------------------
 
-from keras.layers import * 
-from keras.activations import * 
-from keras.models import * 
-from keras.optimizers import * 
-from keras.initializers import * 
-from keras.callbacks import *
+import os
+import numpy as np
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' 
+
+import tensorflow as tf
+tf.logging.set_verbosity(tf.logging.ERROR)
+
+from keras.layers import Input, Embedding, SpatialDropout1D, LSTM, GRU, Bidirectional, Conv1D, \
+                         GlobalMaxPooling1D, Dense, Dropout, BatchNormalization
+from keras.models import Model
+from keras.optimizers import Adam
+from keras.callbacks import ReduceLROnPlateau, EarlyStopping
 
 from dataset import Dataset
 
@@ -26,20 +33,30 @@ class RNN:
     # -------------------------------------------------------------------------
     # ctor
 
-    def __init__(self, learning_rate, dataset:Dataset, model_path, variant):
+    # embedding_size and filters (Conv1D filters of variant 4, recurrent units of
+    # variants 1-3) default to the sizes of the respective variant.
+
+    def __init__(self, learning_rate, dataset:Dataset, model_path, variant, embedding_size = None, filters = None):
         self.model_path = model_path
+        self.variant = variant
         self.verbose = 1
+        self.history = None
+
+        embedding_size = embedding_size or (256 if variant == 4 else 128)
+        filters = filters or { 1: 64, 2: 256, 3: 128, 4: 1024 }.get(variant)
+
+        # variable sequence length (None), see dataset.get_padded_length
 
         input_tensor = model_stack = Input(dataset.get_input_shape())
 
         if variant == 1:
-            model_stack = Embedding(input_dim = dataset.get_input_dim(), output_dim = 128, input_length = dataset.get_input_shape()[0])(model_stack)
+            model_stack = Embedding(input_dim = dataset.get_input_dim(), output_dim = embedding_size)(model_stack)
             model_stack = SpatialDropout1D(0.7)(model_stack)
-            model_stack = LSTM(64, dropout=0.7, recurrent_dropout=0.7)(model_stack)
+            model_stack = LSTM(filters, dropout=0.7, recurrent_dropout=0.7)(model_stack)
             model_stack = Dense(dataset.get_num_classes(), activation='softmax')(model_stack)
         elif variant == 2:
-            model_stack = Embedding(input_dim = dataset.get_input_dim(), output_dim = 128, input_length = dataset.get_input_shape()[0])(model_stack)
-            model_stack = LSTM(256)(model_stack)
+            model_stack = Embedding(input_dim = dataset.get_input_dim(), output_dim = embedding_size)(model_stack)
+            model_stack = LSTM(filters)(model_stack)
             model_stack = Dropout(0.5)(model_stack)
             model_stack = BatchNormalization()(model_stack)
             model_stack = Dropout(0.5)(model_stack)
@@ -49,8 +66,8 @@ class RNN:
             model_stack = Dropout(0.5)(model_stack)
             model_stack = Dense(dataset.get_num_classes(), activation='softmax')(model_stack)
         elif variant == 3:
-            model_stack = Embedding(input_dim = dataset.get_input_dim(), output_dim = 128, input_length = dataset.get_input_shape()[0])(model_stack)
-            model_stack = Bidirectional(GRU(128))(model_stack)
+            model_stack = Embedding(input_dim = dataset.get_input_dim(), output_dim = embedding_size)(model_stack)
+            model_stack = Bidirectional(GRU(filters))(model_stack)
             model_stack = Dense(64, activation='relu')(model_stack)
             model_stack = Dropout(0.5)(model_stack)
             model_stack = Dense(64, activation='relu')(model_stack)
@@ -58,8 +75,8 @@ class RNN:
             model_stack = BatchNormalization()(model_stack)
             model_stack = Dense(dataset.get_num_classes(), activation='softmax')(model_stack)
         elif variant == 4:
-            model_stack = Embedding(input_dim = dataset.get_input_dim(), output_dim = 256, input_length = dataset.get_input_shape()[0])(model_stack)
-            model_stack = Conv1D(1024, 3, padding='valid', strides = 1, activation='relu')(model_stack)
+            model_stack = Embedding(input_dim = dataset.get_input_dim(), output_dim = embedding_size)(model_stack)
+            model_stack = Conv1D(filters, 3, padding='valid', strides = 1, activation='relu')(model_stack)
             model_stack = GlobalMaxPooling1D()(model_stack)
             model_stack = Dropout(0.5)(model_stack)
             model_stack = BatchNormalization()(model_stack)
@@ -73,16 +90,24 @@ class RNN:
         self.model = Model(inputs = [input_tensor], outputs = [model_stack])
         self.model.compile(loss = "binary_crossentropy", optimizer = Adam(lr = learning_rate), metrics = ["accuracy"])
 
+        # remember the graph, predictions may be run from a worker thread
+
+        self.graph = tf.get_default_graph()
+
     # -------------------------------------------------------------------------
-    # train
+    # train (returns the [loss, accuracy] score on the test set)
 
-    def train(self, epochs, batch_size, dataset:Dataset):
-        self.model.summary()
+    def train(self, epochs, batch_size, dataset:Dataset, patience = 5):
+        if self.verbose:
+            self.model.summary()
 
         callbacks = []
 
         callbacks.append(ReduceLROnPlateau(monitor = "val_loss", factor = 0.95, verbose = self.verbose, patience = 1))
-        callbacks.append(EarlyStopping(monitor='val_loss', patience = 5, min_delta = 0.01, restore_best_weights = True, verbose = self.verbose))
+        callbacks.append(EarlyStopping(monitor='val_loss', patience = patience, min_delta = 0.01, restore_best_weights = True, verbose = self.verbose))
+
+        if dataset.streaming:
+            return self.train_streaming(epochs, batch_size, dataset, callbacks)
 
         validation = None
 
@@ -91,7 +116,7 @@ class RNN:
         else:
             validation = [dataset.x_test, dataset.y_test]
 
-        self.model.fit(
+        self.history = self.model.fit(
             x = dataset.x_train,
             y = dataset.y_train,
             batch_size = batch_size,
@@ -104,22 +129,48 @@ class RNN:
 
         print("Model score: {}".format(score))
 
+        return score
+
+    # -------------------------------------------------------------------------
+    # train_streaming (StreamingDataset, batches are read from the sequence store)
+
+    def train_streaming(self, epochs, batch_size, dataset, callbacks):
+        self.history = self.model.fit_generator(
+            dataset.generate_batches("train", batch_size, shuffle = True, loop = True),
+            steps_per_epoch = dataset.get_num_batches("train", batch_size),
+            verbose = self.verbose,
+            epochs = epochs,
+            validation_data = dataset.generate_batches("valid", batch_size, loop = True),
+            validation_steps = dataset.get_num_batches("valid", batch_size),
+            callbacks = callbacks)
+
+        score = self.model.evaluate_generator(dataset.generate_batches("test", batch_size, loop = True), 
+                                              steps = dataset.get_num_batches("test", batch_size))
+
+        print("Model score: {}".format(score))
+
+        return score
+
     # -------------------------------------------------------------------------
     # predict
 
     def predict(self, texts, dataset:Dataset):
-        res = []
+        if len(texts) == 0:
+            return []
+
+        # tokenize/pad the whole batch at once and run a single forward pass. length
+        # buckets are only exact for the Conv1D variant
 
-        for text in texts:
-            prepared = dataset.prepare_array([text])
-            pred = self.model.predict(prepared)
+        prepared = dataset.prepare_array(texts, bucketed = self.variant == 4, reuse = True)
 
-            cls = dataset.get_classes()[np.argmax(pred)]
-            acc = pred[0][dataset.get_classes().index(cls)]
+        with self.graph.as_default():
+            pred = self.model.predict(prepared, batch_size = len(texts))
 
-            res.append((cls, acc))
+        classes = dataset.get_classes()
+        idx = np.argmax(pred, axis = 1)
+        acc = pred[np.arange(len(idx)), idx]
 
-        return res
+        return [(classes[i], a) for i, a in zip(idx, acc)]
 
     # -------------------------------------------------------------------------
     # load_weights
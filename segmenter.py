@@ -0,0 +1,124 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# segmenter.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import re
+
+BACKENDS = ["spacy", "sentencizer", "rules"]
+
+# -----------------------------------------------------------------------------
+# create_segmenter
+#
+# backend "spacy":       full spaCy pipeline (tagger, parser, ner), sentences
+#                        from the dependency parse
+# backend "sentencizer": spaCy tokenizer + rule based sentencizer only
+# backend "rules":       RuleSegmenter, no spaCy at all
+# -----------------------------------------------------------------------------
+
+def create_segmenter(backend, nlp_module):
+    if backend == "rules":
+        return RuleSegmenter()
+
+    if backend == "spacy" or backend == "sentencizer":
+        return SpacySegmenter(nlp_module, sentencizer = backend == "sentencizer")
+
+    raise ValueError("Unknown segmenter '{}'".format(backend))
+
+# -----------------------------------------------------------------------------
+# class SpacySegmenter
+# -----------------------------------------------------------------------------
+
+class SpacySegmenter:
+
+    # -------------------------------------------------------------------------
+    # ctor
+
+    def __init__(self, nlp_module, sentencizer = False, batch_size = 32):
+        import spacy
+
+        self.batch_size = batch_size
+
+        if sentencizer:
+            self.nlp = spacy.load(nlp_module, disable = ["tagger", "parser", "ner"])
+            self.nlp.add_pipe(self.nlp.create_pipe("sentencizer"))
+        else:
+            self.nlp = spacy.load(nlp_module)
+
+    # -------------------------------------------------------------------------
+    # split
+
+    def split(self, text):
+        return [sent.string.strip() for sent in self.nlp(text).sents]
+
+    # -------------------------------------------------------------------------
+    # split_many (one nlp.pipe pass over several messages)
+
+    def split_many(self, texts):
+        return [[sent.string.strip() for sent in doc.sents] for doc in self.nlp.pipe(texts, batch_size = self.batch_size)]
+
+# -----------------------------------------------------------------------------
+# class RuleSegmenter
+#
+# sentence splitter for german chat: sentences end at line breaks and at
+# runs of .!? (plus closing quotes/brackets) followed by whitespace. a period
+# after a known abbreviation ("z.B.", "bzw.") or a number ("am 3. Tag") does
+# not end a sentence.
+# -----------------------------------------------------------------------------
+
+ABBREVIATIONS = { "z.b.", "bzw.", "usw.", "ca.", "evtl.", "d.h.", "u.a.", "nr.", "vgl.", "ggf.", "inkl.", "max.",
+                  "min.", "etc.", "bspw.", "insb.", "zb.", "dh.", "o.ä.", "u.u.", "s.", "str.", "e.g.", "i.e.", "vs." }
+
+class RuleSegmenter:
+
+    # -------------------------------------------------------------------------
+    # ctor
+
+    def __init__(self):
+        self.boundary = re.compile(r'([.!?…]+["\'“”»«)\]]*)(?=\s|$)|\n')
+        self.last_word = re.compile(r'(\S+)$')
+
+    # -------------------------------------------------------------------------
+    # split
+
+    def split(self, text):
+        res = []
+        start = 0
+
+        for m in self.boundary.finditer(text):
+            if m.group(1) is None:
+                end = m.start()
+            else:
+                end = m.end()
+
+                if m.group(1) == ".":
+                    word = self.last_word.search(text, start, m.end())
+                    token = word.group(1).lstrip("(\"'„“»«").lower() if word is not None else ""
+
+                    if token in ABBREVIATIONS or token[:-1].isdigit():
+                        continue
+
+            sentence = text[start:end].strip()
+
+            if sentence:
+                res.append(sentence)
+
+            start = m.end()
+
+        sentence = text[start:].strip()
+
+        if sentence:
+            res.append(sentence)
+
+        return res
+
+    # -------------------------------------------------------------------------
+    # split_many
+
+    def split_many(self, texts):
+        return [self.split(text) for text in texts]
@@ -13,13 +13,159 @@ import os.path
 import re as rep
 import logging
 import time
-import copy
-from threading import Thread, Lock, Event
+import hashlib
+import json
+import random
+from collections import namedtuple
+from array import array
+from threading import Thread, Event, Lock
 
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 
+import metrics
+
+from matcher import KeywordMatcher
+from locations import LocationStore
+from cachefile import read_cache_file, write_cache_file, CacheFileError
+
+# -----------------------------------------------------------------------------
+# Match - entity found in a message
+# -----------------------------------------------------------------------------
+
+# kind:  "resource_en", "resource_de", "island" or "grid"
+# key:   resource key (lowercase) / island name / grid name as stored in the cache
+# start: start offset in the message, end: end offset (exclusive)
+# rank:  position of the key within its map/list, used to keep result order stable
+
+Match = namedtuple("Match", ["kind", "key", "start", "end", "rank"])
+
+GRID_DELIMITER_EXCLUDED = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789")
+
+# -----------------------------------------------------------------------------
+# class ResourceIndex - precomputed answers for one resource map
+# -----------------------------------------------------------------------------
+
+class ResourceIndex:
+
+    # -------------------------------------------------------------------------
+    # ctor
+    #
+    # resource_map: resource key -> { "title", "records": [record ids] }
+    # store:        LocationStore holding the records
+    # listed:       predicate on a record id, marking a resource as being listed at all
+
+    def __init__(self, resource_map, store, listed):
+        self.entries = {}
+        self.islands_by_grid = {}
+
+        for key, resource in resource_map.items():
+            found_grids = {}
+
+            for rid in resource["records"]:
+                if store.is_available(rid):
+                    found_grids.setdefault(store.grid(rid), []).append(store.island(rid))
+
+            for grid, islands in found_grids.items():
+                self.islands_by_grid[(key, grid)] = tuple(islands)
+
+            # ready-to-send location string (like : 'A1 (Island1, Island2), A3 (Island1, Island5)')
+
+            location = ", ".join([grid + " (" + ", ".join(islands) + ")" for grid, islands in found_grids.items()])
+
+            self.entries[key] = { "title": resource["title"],
+                                  "listed": any(listed(rid) for rid in resource["records"]),
+                                  "location": location,
+                                  "grids": tuple(found_grids.keys()) }
+
+    # -------------------------------------------------------------------------
+    # get
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    # -------------------------------------------------------------------------
+    # get_islands
+
+    def get_islands(self, key, grid):
+        return self.islands_by_grid.get((key, grid), ())
+
+# -----------------------------------------------------------------------------
+# inflections
+#
+# spellings of a (lowercase) resource key in german chat. matching is done on
+# substrings, so suffixes ("holzes", "steine") are covered by the key itself,
+# only stem changes need variants: umlaut plurals ("nuss" -> "nüsse") and
+# ss/ß spelling ("nuss" <-> "nuß").
+# -----------------------------------------------------------------------------
+
+UMLAUTS = { "a": "ä", "o": "ö", "u": "ü" }
+
+def inflections(key):
+    res = { key, key.replace("ss", "ß"), key.replace("ß", "ss") }
+
+    for variant in list(res):
+        stem = variant
+
+        for suffix in ["er", "el", "en", "e"]:
+            if stem.endswith(suffix) and len(stem) > len(suffix) + 1:
+                stem = stem[:-len(suffix)]
+                break
+
+        vowels = [i for i, char in enumerate(stem) if char in "aeiouäöü"]
+
+        # umlaut on the last stem vowel ("holz" -> "hölzer", "mantel" -> "mäntel", "baum" -> "bäume")
+
+        if vowels and variant[vowels[-1]] in UMLAUTS:
+            pos = vowels[-1]
+
+            if pos > 0 and variant[pos - 1] == "a" and variant[pos] == "u":
+                pos -= 1
+
+            res.add(variant[:pos] + UMLAUTS[variant[pos]] + variant[pos + 1:])
+
+    return sorted(res)
+
+# -----------------------------------------------------------------------------
+# class SheetsSnapshot - immutable view of the cache
+# -----------------------------------------------------------------------------
+
+class SheetsSnapshot:
+
+    # -------------------------------------------------------------------------
+    # ctor
+    #
+    # a snapshot is built completely before it is published and never modified
+    # afterwards, so readers can use it without locking.
+
+    def __init__(self, resource_map_en, resource_map_de, store, version = 0):
+        self.version = version
+        self.resource_map_en = resource_map_en
+        self.resource_map_de = resource_map_de
+        self.store = store
+        self.islands = tuple(sorted(store.island_names))
+        self.grids = tuple(sorted(store.grid_names))
+        self.keys = tuple(sorted(set(resource_map_en.keys()) | set(resource_map_de.keys())))
+
+        self.matcher = self.build_matcher()
+        self.gate = KeywordMatcher((variant, None) for key in self.keys for variant in inflections(key))
+        self.index_en = ResourceIndex(resource_map_en, store, store.is_available)
+        self.index_de = ResourceIndex(resource_map_de, store, store.is_unavailable)
+
+    # -------------------------------------------------------------------------
+    # build_matcher (automaton over resource keys, islands and grids)
+
+    def build_matcher(self):
+        patterns = []
+
+        patterns.extend((key, ("resource_en", key, rank)) for rank, key in enumerate(self.resource_map_en.keys()))
+        patterns.extend((key, ("resource_de", key, rank)) for rank, key in enumerate(self.resource_map_de.keys()))
+        patterns.extend((island.lower(), ("island", island, rank)) for rank, island in enumerate(self.islands))
+        patterns.extend((grid.lower(), ("grid", grid, rank)) for rank, grid in enumerate(self.grids))
+
+        return KeywordMatcher(patterns)
+
 # -----------------------------------------------------------------------------
 # class SheetsCache
 # -----------------------------------------------------------------------------
@@ -29,18 +175,18 @@ class SheetsCache(Thread):
     # -------------------------------------------------------------------------
     # ctor
 
-    def __init__(self, cache_store_dir, credentials_path, token_path, sheet_id, refresh_time):
+    def __init__(self, cache_store_dir, credentials_path, token_path, sheet_id, refresh_time, 
+                 min_refresh_interval = 10, backoff_base = 5, backoff_max = 600):
         Thread.__init__(self)
 
         self.log = logging.getLogger(__name__)
 
         self.stop_event = Event()
-        self.cache_mutex = Lock()
+        self.wakeup_event = Event()
+        self.request_mutex = Lock()
+        self.refresh_requested = False
 
-        self.cache_store_path_en = cache_store_dir + "/resource_cache_en.dat"
-        self.cache_store_path_de = cache_store_dir + "/resource_cache_de.dat"
-        self.cache_store_path_islands = cache_store_dir + "/islands_cache.dat"
-        self.cache_store_path_grids = cache_store_dir + "/grids_cache.dat"
+        self.cache_store_path = cache_store_dir + "/sheets_cache.bin"
 
         self.sheet_id = sheet_id
         self.credentials_path = credentials_path
@@ -50,60 +196,164 @@ class SheetsCache(Thread):
         self.service = None
         self.connected = False
         self.refresh_time = refresh_time
+        self.min_refresh_interval = min_refresh_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failures = 0
+        self.last_refresh = 0
 
         self.log.info("Reloading cache every {} seconds".format(self.refresh_time))
 
         self.scopes = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
 
-        self.resource_map_en = {}
-        self.resource_map_de = {}
-        self.all_islands = list()
-        self.all_grids = list()
+        # the cache file is loaded lazily on first access
+
+        self.snapshot = None
+        self.load_mutex = Lock()
+        self.parsed_grids = {}
+        self.reload_listeners = []
 
-        if (os.path.exists(self.cache_store_path_en) 
-            and os.path.exists(self.cache_store_path_de) 
-            and os.path.exists(self.cache_store_path_islands) 
-            and os.path.exists(self.cache_store_path_grids)):
+        metrics.sheets_version.set_function(lambda: self.snapshot.version if self.snapshot is not None else 0)
+        metrics.sheets_resources.set_function(lambda: len(self.snapshot.keys) if self.snapshot is not None else 0)
 
-            self.log.info("Loading resource cache from filesytem ...")
+    # -------------------------------------------------------------------------
+    # get_snapshot
 
-            with open(self.cache_store_path_en, "rb") as f:
-                self.resource_map_en = pickle.load(f)
+    def get_snapshot(self):
+        snapshot = self.snapshot
 
-            with open(self.cache_store_path_de, "rb") as f:
-                self.resource_map_de = pickle.load(f)
+        if snapshot is None:
+            snapshot = self.load_cache()
 
-            with open(self.cache_store_path_islands, "rb") as f:
-                self.all_islands = pickle.load(f)
+        return snapshot
+
+    # -------------------------------------------------------------------------
+    # add_reload_listener
+    #
+    # func(snapshot) is called (from the reloading thread) whenever a reloaded
+    # snapshot has been published, e.g. to invalidate caches of lookup results.
 
-            with open(self.cache_store_path_grids, "rb") as f:
-                self.all_grids = pickle.load(f)
+    def add_reload_listener(self, func):
+        self.reload_listeners.append(func)
+
+    # -------------------------------------------------------------------------
+    # load_cache (from filesystem)
+
+    def load_cache(self):
+        with self.load_mutex:
+            if self.snapshot is not None:
+                return self.snapshot
+
+            snapshot = SheetsSnapshot({}, {}, LocationStore())
+
+            if os.path.exists(self.cache_store_path):
+                self.log.info("Loading resource cache from filesytem ...")
+
+                try:
+                    snapshot = SheetsSnapshot(*read_cache_file(self.cache_store_path))
+                except (CacheFileError, OSError) as e:
+                    self.log.error("Failed to load resource cache '{}', ignoring ({})".format(self.cache_store_path, e))
+
+            self.snapshot = snapshot
+            return snapshot
 
     # -------------------------------------------------------------------------
     # run
 
     def run(self):
-        self.connected = self.connect()
+        try:
+            self.connected = self.connect()
+        except Exception as e:
+            self.log.error("Failed to connect ({})".format(e))
 
         if self.connected:
             self.log.info("Connected.")
 
-        cur_time = time.time()
+        self.last_refresh = time.time()
+        next_refresh = self.last_refresh + self.refresh_time
 
-        while not self.stop_event.wait(0.2):
-            if time.time() - cur_time >= self.refresh_time:
-                try:
-                    self.reload_cache()
-                except Exception as e:
-                    self.log.error("Failed to reload cache ({})".format(e))
+        # sleep until the next refresh is due, or until woken up by
+        # request_refresh() / stop()
 
-                cur_time = time.time()
+        while not self.stop_event.is_set():
+            self.wakeup_event.wait(max(0.0, next_refresh - time.time()))
+            self.wakeup_event.clear()
+
+            if self.stop_event.is_set():
+                break
+
+            now = time.time()
+
+            with self.request_mutex:
+                requested = self.refresh_requested
+
+            if now < next_refresh:
+                if not requested:
+                    continue
+
+                # requested refreshes are coalesced and rate limited
+
+                if now - self.last_refresh < self.min_refresh_interval:
+                    next_refresh = self.last_refresh + self.min_refresh_interval
+                    continue
+
+            with self.request_mutex:
+                self.refresh_requested = False
+
+            next_refresh = self.refresh()
+
+    # -------------------------------------------------------------------------
+    # refresh (returns the time of the next due refresh)
+
+    def refresh(self):
+        success = False
+        started = time.time()
+
+        try:
+            # not connected yet (e.g. no network on startup), connect first so
+            # the retries can recover
+
+            if self.service is None:
+                self.connected = self.connect()
+
+            success = self.reload_cache()
+        except Exception as e:
+            self.log.error("Failed to reload cache ({})".format(e))
+
+        metrics.sheets_reload.observe(time.time() - started, result = "success" if success else "failure")
+
+        self.last_refresh = time.time()
+
+        if success:
+            self.failures = 0
+            return self.last_refresh + self.refresh_time
+
+        # exponential backoff with jitter, but never wait longer than the regular interval
+
+        self.failures += 1
+
+        delay = min(self.backoff_max, self.refresh_time, self.backoff_base * (2 ** (self.failures - 1)))
+        delay = random.uniform(delay / 2, delay)
+
+        self.log.info("Retrying reload in {:.1f} seconds".format(delay))
+
+        return self.last_refresh + delay
+
+    # -------------------------------------------------------------------------
+    # request_refresh (reload as soon as possible, e.g. on admin request)
+
+    def request_refresh(self):
+        with self.request_mutex:
+            self.refresh_requested = True
+
+        self.wakeup_event.set()
 
     # -------------------------------------------------------------------------
     # stop
 
     def stop(self):
         self.stop_event.set()
+        self.wakeup_event.set()
 
     # -------------------------------------------------------------------------
     # connect to google sheets (login & obtain token)
@@ -146,11 +396,6 @@ class SheetsCache(Thread):
             self.log.error("Not connected, cannot reload cache")
             return False
 
-        new_resource_map_en = {}
-        new_resource_map_de = {}
-        new_all_islands = set()
-        new_all_grids = set()
-
         self.log.info("Reloading sheets data cache ...")
         
         # query list of sheets in document
@@ -162,220 +407,260 @@ class SheetsCache(Thread):
             return False
 
         sheet_names = [sheet['properties']['title'] for sheet in sheet_metadata['sheets']]
+        grid_names = [name for name in sheet_names if "template" not in name.lower()]
 
         self.log.info("Found sheets: {}".format(", ".join(sheet_names)))
 
-        # loop grids
+        # fetch all grids with a single request
 
-        for grid_name in sheet_names:
-            if "template" in grid_name.lower():
-                continue
+        result = self.service.spreadsheets().values().batchGet(spreadsheetId = self.sheet_id, 
+                                                               ranges = grid_names).execute()
 
-            result = self.service.spreadsheets().values().get(spreadsheetId = self.sheet_id, 
-                                                                range = grid_name).execute()
+        if not result or len(result.get('valueRanges', [])) != len(grid_names):
+            self.log.info("Received malformed when querying sheet data")
+            return False
 
-            if not result:
-                self.log.info("Received malformed when querying sheet data")
-                return False
-            
-            rows = result.get('values', [])
+        # only parse grids whose content changed since the last reload
 
-            # loop all rows of the grid.
-            # row 1:    title in col 0 and island names in col >0
-            # row >1:   resource name in col 0 and True/False in col >0
+        new_parsed_grids = {}
+        changed_grids = []
 
-            for row_num in range(1, len(rows)):
-                row = rows[row_num]
-                resource_en = None
-                resource_de = None
+        for grid_name, value_range in zip(grid_names, result['valueRanges']):
+            rows = value_range.get('values', [])
+            digest = hashlib.sha1(json.dumps(rows, ensure_ascii = False).encode("utf-8")).hexdigest()
+            previous = self.parsed_grids.get(grid_name)
 
-                for col in range(len(row)):
-                    if col >= len(rows[0]):
-                        break
+            if previous is not None and previous[0] == digest:
+                new_parsed_grids[grid_name] = previous
+            else:
+                new_parsed_grids[grid_name] = (digest, self.parse_grid(grid_name, rows))
+                changed_grids.append(grid_name)
 
-                    island_name = rows[0][col]
+        removed_grids = [name for name in self.parsed_grids if name not in new_parsed_grids]
 
-                    # remember the resource we're talking about if this is col 0
-                    # also kind of normalize the name
+        current = self.get_snapshot()
 
-                    if col == 0:
-                        resource_en = row[col].split("/")[0].lower().strip()
-                        resource_de = row[col].split("/")[-1].lower().strip()
+        if not changed_grids and not removed_grids and current.version > 0:
+            self.log.info("Sheets data unchanged.")
+            return True
 
-                        if resource_en.endswith("(nodes)"):
-                            resource_en = rep.sub('[ ]*\\(nodes\\)', '', resource_en)
+        self.log.info("Changed sheets: {}".format(", ".join(changed_grids + removed_grids)))
 
-                        if resource_de.endswith("ader"):
-                            resource_de = rep.sub('ader$', '', resource_de)
+        self.parsed_grids = new_parsed_grids
 
-                        if resource_en and resource_en not in new_resource_map_en and "(" not in resource_en:
-                            new_resource_map_en[resource_en] = { "title": row[col], "info": [] }
+        # merge all grids (in sheet order) into the resource maps
 
-                        if resource_de and resource_de not in new_resource_map_de and "(" not in resource_de:
-                            new_resource_map_de[resource_de] = { "title": row[col], "info": [] }
-                    else:
-                        if resource_en == "" or "(" in resource_de or "(" in resource_en:
-                            continue
+        new_resource_map_en = {}
+        new_resource_map_de = {}
+        new_store = LocationStore()
 
-                        # append the location to the global map and the grid info
+        for grid_name in grid_names:
+            for resource_en, resource_de, title, infos in new_parsed_grids[grid_name][1]:
+                if resource_en and resource_en not in new_resource_map_en and "(" not in resource_en:
+                    new_resource_map_en[resource_en] = { "title": title, "records": array("I") }
 
-                        info = { "grid": grid_name[:2], 
-                                "island": island_name, 
-                                "cell": chr(ord('A')+col) + str(row_num),
-                                "avail": row[col] }
+                if resource_de and resource_de not in new_resource_map_de and "(" not in resource_de:
+                    new_resource_map_de[resource_de] = { "title": title, "records": array("I") }
 
-                        new_all_islands.add(island_name)
-                        new_all_grids.add(grid_name[:2])
+                if not infos:
+                    continue
 
-                        new_resource_map_en[resource_en]["info"].append(info)
-                        new_resource_map_de[resource_de]["info"].append(info)
+                # both maps reference the same location records
 
-        # make reloaded lists available
+                records = [new_store.add(grid_name[:2], island, col, row, avail) for island, col, row, avail in infos]
 
-        self.cache_mutex.acquire()
+                new_resource_map_en[resource_en]["records"].extend(records)
+                new_resource_map_de[resource_de]["records"].extend(records)
 
-        try:
-            self.resource_map_en = new_resource_map_en
-            self.resource_map_de = new_resource_map_de
-            self.all_islands = list(sorted(new_all_islands))
-            self.all_grids = list(sorted(new_all_grids))
-        finally:
-            self.cache_mutex.release()
+        # make reloaded lists available. readers keep using the snapshot they already
+        # hold, new readers pick up the new one (reference assignment is atomic)
 
-        # and dump them to the fs for later re-use without re-query
+        snapshot = SheetsSnapshot(new_resource_map_en, new_resource_map_de, new_store, 
+                                  version = current.version + 1)
 
-        with open(self.cache_store_path_en, 'wb') as f:
-            pickle.dump(self.resource_map_en, f, pickle.HIGHEST_PROTOCOL)
+        self.snapshot = snapshot
 
-        with open(self.cache_store_path_de, 'wb') as f:
-            pickle.dump(self.resource_map_de, f, pickle.HIGHEST_PROTOCOL)
+        for func in self.reload_listeners:
+            try:
+                func(snapshot)
+            except Exception as e:
+                self.log.error("Reload listener failed ({})".format(e))
 
-        with open(self.cache_store_path_islands, 'wb') as f:
-            pickle.dump(self.all_islands, f, pickle.HIGHEST_PROTOCOL)
+        # and dump them to the fs for later re-use without re-query
 
-        with open(self.cache_store_path_grids, 'wb') as f:
-            pickle.dump(self.all_grids, f, pickle.HIGHEST_PROTOCOL)
+        try:
+            write_cache_file(self.cache_store_path, snapshot.resource_map_en, snapshot.resource_map_de, snapshot.store)
+        except Exception as e:
+            self.log.error("Failed to write resource cache '{}' ({})".format(self.cache_store_path, e))
 
         self.log.info("Done reloading cache.")
         return True
 
     # -------------------------------------------------------------------------
-    # find_resource
+    # parse_grid
+    #
+    # returns a list of (resource_en, resource_de, title, infos) per resource row.
+    # infos (locations, tuples of island, col, row, avail) are only given for rows 
+    # with valid resource names.
 
-    def find_resource(self, search_string, only_grids = False):
-        self.cache_mutex.acquire()
-        res = None
+    def parse_grid(self, grid_name, rows):
+        res = []
 
-        try:
-            res = self.find_resource_locked(search_string, only_grids)
-        finally:
-            self.cache_mutex.release()
+        # loop all rows of the grid.
+        # row 1:    title in col 0 and island names in col >0
+        # row >1:   resource name in col 0 and True/False in col >0
+
+        for row_num in range(1, len(rows)):
+            row = rows[row_num]
+
+            if not row or not rows[0]:
+                continue
+
+            # remember the resource we're talking about (col 0)
+            # also kind of normalize the name
+
+            title = row[0]
+            resource_en = title.split("/")[0].lower().strip()
+            resource_de = title.split("/")[-1].lower().strip()
+
+            if resource_en.endswith("(nodes)"):
+                resource_en = rep.sub('[ ]*\\(nodes\\)', '', resource_en)
+
+            if resource_de.endswith("ader"):
+                resource_de = rep.sub('ader$', '', resource_de)
+
+            infos = []
+
+            if not (resource_en == "" or "(" in resource_de or "(" in resource_en):
+                for col in range(1, min(len(row), len(rows[0]))):
+                    infos.append((rows[0][col], col, row_num, row[col]))
+
+            res.append((resource_en, resource_de, title, infos))
 
         return res
 
-    def find_resource_locked(self, search_string, only_grids = False):
-        resource_infos = []
-        titles = []
-        search_string_lower = search_string.lower()
+    # -------------------------------------------------------------------------
+    # find_entities
+    #
+    # single pass over the message, returns a list of Match tuples for every
+    # resource key, island and grid contained in it. grids only match when
+    # delimited by a non-alphanumeric character before and a non-alphanumeric
+    # character or end of message after ("Wo in C2 gibts Holz?").
 
-        for key in self.resource_map_en.keys():
-            if key in search_string_lower:
-                available_at_all = [x for x in self.resource_map_en[key]["info"] if x["avail"] == 'TRUE']
-                
-                if available_at_all:
-                    resource_infos.append(self.resource_map_en[key])
+    def find_entities(self, message):
+        return self.find_entities_in(self.get_snapshot(), message)
 
-                titles.append(self.resource_map_en[key]["title"])
+    def find_entities_in(self, snapshot, message):
+        matcher = snapshot.matcher
+        msg_lower = message.lower()
+        res = []
 
-        for key in self.resource_map_de.keys():
-            if key in search_string_lower:
-                available_at_all = [x for x in self.resource_map_de[key]["info"] if x["avail"] == 'FALSE']
+        for start, end, (kind, key, rank) in matcher.find_all(msg_lower):
+            if kind == "grid":
+                if start == 0 or msg_lower[start - 1] in GRID_DELIMITER_EXCLUDED:
+                    continue
 
-                if available_at_all:
-                    resource_infos.append(self.resource_map_de[key])
+                if end < len(msg_lower) and msg_lower[end] in GRID_DELIMITER_EXCLUDED:
+                    continue
 
-                titles.append(self.resource_map_de[key]["title"])
+            res.append(Match(kind, key, start, end, rank))
 
-        # found?
+        return res
 
-        if len(resource_infos) <= 0:
-            if len(titles) > 0:
-                return { "title": "/".join(titles), "not_yet_in_list": True }
+    # -------------------------------------------------------------------------
+    # get_version (of the current snapshot)
 
-            return None
+    def get_version(self):
+        return self.get_snapshot().version
 
-        # assemble the response string (like : 'A1 (Island1, Island2), A3 (Island1, Island5)')
+    # -------------------------------------------------------------------------
+    # may_mention_resource
+    #
+    # cheap message level check (no spaCy, no classifier): False if the message
+    # contains no resource key in any inflection, so it can never be answered.
 
-        found_strings = []
-        found_grid_names = []
+    def may_mention_resource(self, message):
+        return self.get_snapshot().gate.contains(message.lower())
 
-        for resource_info in resource_infos:
-            title = resource_info["title"]
-            infos = resource_info["info"]
-            found_grids = {}
-            res = []
+    def has_resource_key(self, message):
+        return any(m.kind == "resource_en" or m.kind == "resource_de" for m in self.find_entities(message))
 
-            for island, grid in [(record["island"],record["grid"]) for record in infos if record["avail"] == "TRUE"]:
-                if grid not in found_grids:
-                    found_grids[grid] = []
+    def matched_keys(self, matches, kind):
+        ranked = { m.key: m.rank for m in matches if m.kind == kind }
+        return sorted(ranked.keys(), key = lambda k: ranked[k])
 
-                found_grids[grid].append(island)
-                found_grid_names.append(grid)
+    # -------------------------------------------------------------------------
+    # find_resource
 
-            for found in found_grids.keys():
-                res.append(found + " (" +  ", ".join(found_grids[found]) + ")")
+    def find_resource(self, search_string, only_grids = False, matches = None):
+        snapshot = self.get_snapshot()
 
-            location = ", ".join(res)
+        if matches is None:
+            matches = self.find_entities_in(snapshot, search_string)
 
-            found_strings.append({ "title": title, "location": location })
-            
-            if not only_grids:
-                self.log.debug("Found resource '{}' in {}".format(title, location))
+        return self.find_resource_in(snapshot, matches, only_grids)
+
+    def find_resource_in(self, snapshot, matches, only_grids = False):
+        entries = []
+        titles = []
+
+        for index, kind in [(snapshot.index_en, "resource_en"), (snapshot.index_de, "resource_de")]:
+            for key in self.matched_keys(matches, kind):
+                entry = index.get(key)
+
+                if entry is None:
+                    continue
+
+                if entry["listed"]:
+                    entries.append(entry)
+
+                titles.append(entry["title"])
+
+        # found?
+
+        if len(entries) <= 0:
+            if len(titles) > 0:
+                return { "title": "/".join(titles), "not_yet_in_list": True }
+
+            return None
 
         if only_grids:
-            return found_grid_names
+            return [grid for entry in entries for grid in entry["grids"]]
+
+        for entry in entries:
+            self.log.debug("Found resource '{}' in {}".format(entry["title"], entry["location"]))
 
-        return found_strings
+        return [{ "title": entry["title"], "location": entry["location"] } for entry in entries]
 
     # -------------------------------------------------------------------------
     # find_resource_by_grid
 
-    def find_resource_by_grid(self, search_string, only_grids = False):
-        self.cache_mutex.acquire()
-        res = None
+    def find_resource_by_grid(self, search_string, grid, matches = None):
+        snapshot = self.get_snapshot()
 
-        try:
-            res = self.find_resource_by_grid_locked(search_string, only_grids)
-        finally:
-            self.cache_mutex.release()
+        if matches is None:
+            matches = self.find_entities_in(snapshot, search_string)
 
-        return res
+        return self.find_resource_by_grid_in(snapshot, matches, grid)
 
-    def find_resource_by_grid_locked(self, search_string, grid):
+    def find_resource_by_grid_in(self, snapshot, matches, grid):
         islands = []
-        other_grid_islands = []
         title = None
 
-        for key in self.resource_map_en.keys():
-            if key in search_string.lower():
-                title = self.resource_map_en[key]["title"]
-
-                for info in self.resource_map_en[key]["info"]:
-                    if info["grid"] == grid and info["avail"] == "TRUE":
-                        islands.append(info["island"])
+        for index, kind in [(snapshot.index_en, "resource_en"), (snapshot.index_de, "resource_de")]:
+            for key in self.matched_keys(matches, kind):
+                entry = index.get(key)
 
-        for key in self.resource_map_de.keys():
-            if key in search_string.lower():
-                title = self.resource_map_de[key]["title"]
+                if entry is None:
+                    continue
 
-                for info in self.resource_map_de[key]["info"]:
-                    if info["grid"] == grid and info["avail"] == "TRUE":
-                        islands.append(info["island"])
+                title = entry["title"]
+                islands.extend(index.get_islands(key, grid))
 
         # found?
 
         if len(islands) <= 0:
-            other_grids = self.find_resource_locked(search_string, only_grids = True)
+            other_grids = self.find_resource_in(snapshot, matches, only_grids = True)
             
             if not other_grids:
                 return None
@@ -390,27 +675,16 @@ class SheetsCache(Thread):
     # get_keys
 
     def get_keys(self):
-        self.cache_mutex.acquire()
-        res = list(sorted(set(list(self.resource_map_en.keys()) + list(self.resource_map_de.keys()))))
-        self.cache_mutex.release()
-
-        return res
+        return self.get_snapshot().keys
 
     # -------------------------------------------------------------------------
     # get_grids
 
     def get_grids(self):
-        self.cache_mutex.acquire()
-        res = copy.copy(self.all_grids)
-        self.cache_mutex.release()
-
-        return res
+        return self.get_snapshot().grids
     
     # -------------------------------------------------------------------------
     # get_islands
 
     def get_islands(self):
-        self.cache_mutex.acquire()
-        res = copy.copy(self.all_islands)
-        self.cache_mutex.release()
-        return res
\ No newline at end of file
+        return self.get_snapshot().islands
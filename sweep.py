@@ -0,0 +1,193 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# sweep.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import time
+import itertools
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# -----------------------------------------------------------------------------
+# default search space (every combination is one trial)
+#
+# filters: Conv1D filters of variant 4, recurrent units of variants 1-3
+# -----------------------------------------------------------------------------
+
+DEFAULT_GRID = { "variant": [4],
+                 "embedding_size": [64, 128, 256],
+                 "filters": [256, 1024],
+                 "learning_rate": [0.0008, 0.002],
+                 "epochs": [10],
+                 "batch_size": [32] }
+
+PARAMETERS = ["variant", "embedding_size", "filters", "learning_rate", "epochs", "batch_size"]
+
+# -----------------------------------------------------------------------------
+# get_trials (grid dict of lists -> list of parameter dicts)
+# -----------------------------------------------------------------------------
+
+def get_trials(grid):
+    values = [grid.get(name, DEFAULT_GRID[name]) for name in PARAMETERS]
+    values = [value if isinstance(value, list) else [value] for value in values]
+
+    return [dict(zip(PARAMETERS, combination)) for combination in itertools.product(*values)]
+
+# -----------------------------------------------------------------------------
+# trial worker
+#
+# trials run in spawned processes on the CPU, each with a tensorflow session
+# limited to `threads` threads, so parallel trials do not compete for cores
+# (and latencies stay comparable). the session is created per trial, as every
+# trial ends with clear_session. the dataset is seeded identically in every
+# process, so all trials see the same train/valid/test split.
+# -----------------------------------------------------------------------------
+
+def init_trial_worker(threads, seed):
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+    import numpy as np
+
+    np.random.seed(seed)
+
+def set_trial_session(threads):
+    import tensorflow as tf
+    from keras import backend
+
+    config = tf.ConfigProto(intra_op_parallelism_threads = threads, inter_op_parallelism_threads = 1)
+    backend.set_session(tf.Session(config = config))
+
+def run_trial(number, params, cache_dir, csv_file, output_dir, seed, patience, latency_samples, threads):
+    import numpy as np
+    import dataset
+    from keras import backend
+    from rnn import RNN
+
+    set_trial_session(threads)
+
+    res = dict(params)
+    res["trial"] = number
+
+    trial_dir = "{}/trial_{:03d}".format(output_dir, number)
+    os.makedirs(trial_dir, exist_ok = True)
+
+    try:
+        np.random.seed(seed)
+
+        ds = dataset.Dataset(cache_dir = cache_dir, csv_file = csv_file, use_tokenizer = True)
+
+        started = time.time()
+
+        model = RNN(params["learning_rate"], ds, trial_dir + "/rnn_" + ds.get_model_filename(), variant = params["variant"],
+                    embedding_size = params["embedding_size"], filters = params["filters"])
+        model.verbose = 0
+
+        score = model.train(params["epochs"], params["batch_size"], ds, patience = patience)
+
+        res["train_s"] = time.time() - started
+        res["epochs_run"] = len(model.history.history.get("val_loss", []))
+        res["accuracy"] = float(score[1])
+
+        # per-sentence latency, single sentences as served by the bot
+
+        texts, categories = ds.get_texts(ds.rows_test[:latency_samples])
+        started = time.perf_counter()
+
+        for text in texts:
+            model.predict([text], ds)
+
+        res["latency_ms"] = (time.perf_counter() - started) / max(1, len(texts)) * 1000.0
+        res["params"] = int(model.model.count_params())
+
+        model.save_weights()
+        res["size_bytes"] = os.path.getsize(model.model_path)
+
+        if params["variant"] == 4:
+            from npmodel import export_keras_model
+
+            export_keras_model(model.model, os.path.splitext(model.model_path)[0] + ".npz")
+    except Exception as e:
+        res["error"] = str(e)
+
+    backend.clear_session()
+
+    return res
+
+# -----------------------------------------------------------------------------
+# mark_pareto_front
+#
+# a trial is on the pareto front if no other trial is at least as good in
+# accuracy, latency and size, and better in at least one of them.
+# -----------------------------------------------------------------------------
+
+def mark_pareto_front(results):
+    valid = [res for res in results if "error" not in res]
+
+    def dominates(a, b):
+        at_least = a["accuracy"] >= b["accuracy"] and a["latency_ms"] <= b["latency_ms"] and a["size_bytes"] <= b["size_bytes"]
+        better = a["accuracy"] > b["accuracy"] or a["latency_ms"] < b["latency_ms"] or a["size_bytes"] < b["size_bytes"]
+
+        return at_least and better
+
+    for res in results:
+        res["pareto"] = "error" not in res and not any(dominates(other, res) for other in valid if other is not res)
+
+    return results
+
+# -----------------------------------------------------------------------------
+# run_sweep
+#
+# runs all trials of grid in `workers` processes. every trial stores its
+# weights (and, for variant 4, the exported model for the numpy runtime) in
+# output_dir/trial_NNN, the results table goes to output_dir/results.json.
+# -----------------------------------------------------------------------------
+
+def run_sweep(grid, cache_dir, csv_file, output_dir, workers = 2, threads = 1, seed = 0, patience = 2,
+              latency_samples = 200, callback = None):
+    import dataset
+
+    trials = get_trials(grid)
+
+    os.makedirs(output_dir, exist_ok = True)
+
+    # build tokenizer and tensor cache once, before the workers read them
+
+    dataset.Dataset(cache_dir = cache_dir, csv_file = csv_file, use_tokenizer = True)
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+
+    with ProcessPoolExecutor(max_workers = workers, mp_context = context, initializer = init_trial_worker,
+                             initargs = (threads, seed)) as executor:
+        futures = [executor.submit(run_trial, number, params, cache_dir, csv_file, output_dir, seed, patience, latency_samples,
+                                   threads)
+                   for number, params in enumerate(trials)]
+
+        for future in as_completed(futures):
+            try:
+                res = future.result()
+            except Exception as e:
+                res = { "error": str(e) }
+
+            results.append(res)
+
+            if callback is not None:
+                callback(res, len(results), len(trials))
+
+    results.sort(key = lambda res: res.get("trial", -1))
+    mark_pareto_front(results)
+
+    with open(output_dir + "/results.json", "w") as f:
+        json.dump({ "grid": grid, "seed": seed, "threads": threads, "results": results }, f, indent = 3)
+
+    return results
@@ -0,0 +1,130 @@
+# -----------------------------------------------------------------------------
+# Atlas/discord chatbot
+# Copyright (c) 2019 - Patrick Fial
+# -----------------------------------------------------------------------------
+# workers.py
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# Imports
+# -----------------------------------------------------------------------------
+
+import asyncio
+import logging
+import multiprocessing
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# -----------------------------------------------------------------------------
+# per-process state (process mode only)
+# -----------------------------------------------------------------------------
+
+worker_segmenter = None
+worker_classifier = None
+
+def init_worker(segmenter_backend, nlp_module, model_dir, runtime, cascade_margin):
+    global worker_segmenter
+    global worker_classifier
+
+    import segmenter
+    import classifier
+    import dataset
+
+    worker_segmenter = segmenter.create_segmenter(segmenter_backend, nlp_module)
+    worker_classifier = classifier.ChatClassifier(model_save_dir = model_dir, 
+                                                  dataset = dataset.InferenceDataset(cache_dir = model_dir),
+                                                  runtime = runtime, cascade_margin = cascade_margin)
+
+def worker_ready():
+    return worker_segmenter is not None and worker_classifier is not None
+
+def worker_split_many(texts):
+    return worker_segmenter.split_many(texts)
+
+def worker_classify(sentences):
+    return worker_classifier.classify(sentences)
+
+# -----------------------------------------------------------------------------
+# class WorkerPool
+# -----------------------------------------------------------------------------
+
+class WorkerPool:
+
+    # -------------------------------------------------------------------------
+    # ctor
+    #
+    # mode "thread":  segmenter, classifier and sheet lookups run in a thread pool
+    #                 of the bot process. Classification batches are serialized
+    #                 on a dedicated thread, as the model is shared.
+    # mode "process": every worker process loads its own segmenter and models.
+    #                 Sheet lookups stay in a thread pool of the bot process, as
+    #                 the sheets cache is owned (and reloaded) there.
+
+    def __init__(self, mode = "thread", workers = 2, segmenter = None, classifier = None, segmenter_backend = "spacy", 
+                 nlp_module = None, model_dir = None, runtime = "keras", cascade_margin = None):
+        self.log = logging.getLogger(__name__)
+        self.mode = mode
+        self.workers = workers
+        self.segmenter = segmenter
+        self.classifier = classifier
+        self.lookup_executor = ThreadPoolExecutor(max_workers = workers)
+
+        if mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers = workers, 
+                                                mp_context = multiprocessing.get_context("spawn"),
+                                                initializer = init_worker,
+                                                initargs = (segmenter_backend, nlp_module, model_dir, runtime, cascade_margin))
+            self.split_many_func = worker_split_many
+            self.classify_func = worker_classify
+            self.classify_executor = self.executor
+        elif mode == "thread":
+            self.executor = self.lookup_executor
+            self.split_many_func = segmenter.split_many
+            self.classify_func = classifier.classify
+            self.classify_executor = ThreadPoolExecutor(max_workers = 1)
+        else:
+            raise ValueError("Unknown executor mode '{}'".format(mode))
+
+        self.log.info("Using {} {} worker(s)".format(workers, mode))
+
+    # -------------------------------------------------------------------------
+    # warm_up (make sure all worker processes have loaded their models)
+
+    async def warm_up(self):
+        if self.mode != "process":
+            return
+
+        loop = asyncio.get_event_loop()
+
+        self.log.info("Waiting for worker processes to load models ...")
+
+        await asyncio.gather(*[loop.run_in_executor(self.executor, worker_ready) for i in range(self.workers)])
+
+        self.log.info("Done.")
+
+    # -------------------------------------------------------------------------
+    # set_prefilter (keyword stage of the classifier cascade, thread mode only,
+    # as the sheets cache lives in the bot process)
+
+    def set_prefilter(self, func):
+        if self.classifier is not None:
+            self.classifier.set_prefilter(func)
+        else:
+            self.log.info("Keyword prefilter not available in {} mode".format(self.mode))
+
+    # -------------------------------------------------------------------------
+    # lookup
+
+    async def lookup(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.lookup_executor, func, *args)
+
+    # -------------------------------------------------------------------------
+    # shutdown
+
+    def shutdown(self):
+        if self.executor is not self.lookup_executor:
+            self.executor.shutdown(wait = False)
+
+        if self.classify_executor is not self.executor:
+            self.classify_executor.shutdown(wait = False)
+
+        self.lookup_executor.shutdown(wait = False)